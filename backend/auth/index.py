@@ -1,190 +1,253 @@
 import json
-import os
-import hashlib
-import secrets
-from typing import Dict, Any
-import psycopg2
+from typing import Dict, Any, List
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+from db import getconn, putconn, warmup
+from instrument import instrumented
+from response import error_response, json_response, preflight
+from tokens import authenticate, issue_token, revoke_token
 
-def generate_token() -> str:
-    return secrets.token_urlsafe(32)
+warmup()
 
+MAX_BULK_USERS = 500
+HASH_BUSY_RETRY_AFTER = '2'
+
+def hashing_busy() -> Dict[str, Any]:
+    '''The KDF pool did not get to this password within HASH_TIMEOUT'''
+    return error_response(503, 'Server busy, try again shortly', {'Retry-After': HASH_BUSY_RETRY_AFTER})
+
+def parse_bulk_users(body_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if body_data.get('csv'):
+        import csv
+        import io
+        return list(csv.DictReader(io.StringIO(body_data['csv'])))
+    return list(body_data.get('users') or [])
+
+def bulk_register(conn, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''
+    COPY valid rows into a staging table and upsert them into users in one statement.
+    Returns one result per input row, in input order.
+    '''
+    results: List[Dict[str, Any]] = []
+    staged = []
+    seen = set()
+    for row_number, entry in enumerate(entries):
+        username = (entry.get('username') or '').strip()
+        password = entry.get('password') or ''
+        if not username or not password:
+            results.append({'row': row_number, 'username': username, 'status': 'invalid'})
+        elif username in seen:
+            results.append({'row': row_number, 'username': username, 'status': 'duplicate'})
+        else:
+            seen.add(username)
+            staged.append((row_number, username, password,
+                           (entry.get('display_name') or username).strip(),
+                           (entry.get('role') or 'Солдат').strip()))
+    
+    if not staged:
+        return results
+    
+    import csv
+    import io
+    from passwords import hash_passwords
+    
+    hashes = hash_passwords([row[2] for row in staged])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for (row_number, username, _, display_name, role), password_hash in zip(staged, hashes):
+        writer.writerow((row_number, username, password_hash, display_name, role))
+    buffer.seek(0)
+    
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TEMP TABLE staging_users (
+                row_number INTEGER,
+                username VARCHAR(255),
+                password_hash VARCHAR(255),
+                display_name VARCHAR(255),
+                role VARCHAR(100)
+            ) ON COMMIT DROP
+        ''')
+        cur.copy_expert('COPY staging_users FROM STDIN WITH (FORMAT csv)', buffer)
+        cur.execute('''
+            WITH new_users AS (
+                INSERT INTO users (username, password_hash, display_name, role)
+                SELECT username, password_hash, display_name, role FROM staging_users
+                ON CONFLICT (username) DO NOTHING
+                RETURNING id, username
+            )
+            SELECT s.row_number, s.username, n.id
+            FROM staging_users s LEFT JOIN new_users n ON n.username = s.username
+        ''')
+        for row_number, username, user_id in cur.fetchall():
+            result = {'row': row_number, 'username': username, 'status': 'created' if user_id else 'exists'}
+            if user_id:
+                result['id'] = user_id
+            results.append(result)
+    conn.commit()
+    
+    return sorted(results, key=lambda result: result['row'])
+
+@instrumented('auth')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: User authentication - register and login
+    Business: User authentication - register (single or bulk), login and logout
     Args: event with httpMethod, body
     Returns: HTTP response with user data and token
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'isBase64Encoded': False,
-            'body': ''
-        }
+        return preflight('POST, OPTIONS', 'Content-Type, Authorization')
     
     if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return error_response(405, 'Method not allowed')
     
     body_data = json.loads(event.get('body', '{}'))
     action = body_data.get('action', 'login')
     username = body_data.get('username', '')
     password = body_data.get('password', '')
     
-    if not username or not password:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Username and password required'})
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    
-    try:
-        conn = psycopg2.connect(dsn)
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Database connection failed'})
-        }
-    
-    if action == 'register':
-        display_name = body_data.get('display_name', username)
-        role = body_data.get('role', 'Солдат')
-        password_hash = hash_password(password)
-        
-        cur = conn.cursor()
+    if action == 'logout':
+        claims = authenticate(event)
+        if not claims:
+            return error_response(401, 'Valid token required')
         
-        safe_username = username.replace("'", "''")
-        cur.execute(f"SELECT id FROM users WHERE username = '{safe_username}'")
-        if cur.fetchone():
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Username already exists'})
-            }
+        conn = getconn()
+        try:
+            revoke_token(conn, claims)
+        finally:
+            putconn(conn)
         
-        safe_display_name = display_name.replace("'", "''")
-        safe_role = role.replace("'", "''")
-        
-        cur.execute(f'''
-            INSERT INTO users (username, password_hash, display_name, role)
-            VALUES ('{safe_username}', '{password_hash}', '{safe_display_name}', '{safe_role}')
-            RETURNING id, username, display_name, role, avatar
-        ''')
-        user_row = cur.fetchone()
-        user = {
-            'id': user_row[0],
-            'username': user_row[1],
-            'display_name': user_row[2],
-            'role': user_row[3],
-            'avatar': user_row[4]
-        }
-        
-        cur.execute(f'''
-            INSERT INTO members (name, role, status, avatar)
-            VALUES ('{display_name}', '{role}', 'online', '{user["avatar"]}')
-        ''')
-        
-        conn.commit()
-        cur.close()
+        return json_response(event, 200, {'success': True}, cache='no-store')
+    
+    if action == 'bulk_register':
+        claims = authenticate(event)
+        if not claims or claims['role'] != 'Офицер':
+            return error_response(403, 'Only officers can register users in bulk')
         
-        conn.close()
+        entries = parse_bulk_users(body_data)
+        if not entries or len(entries) > MAX_BULK_USERS:
+            return error_response(400, f'Provide between 1 and {MAX_BULK_USERS} users')
         
-        token = generate_token()
+        from concurrent.futures import TimeoutError as HashTimeout
+        conn = getconn()
+        try:
+            results = bulk_register(conn, entries)
+        except HashTimeout:
+            conn.rollback()
+            return hashing_busy()
+        finally:
+            putconn(conn)
         
-        return {
-            'statusCode': 201,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({
+        return json_response(event, 200, {
+            'results': results,
+            'created': sum(1 for result in results if result['status'] == 'created')
+        }, cache='no-store')
+    
+    if not username or not password:
+        return error_response(400, 'Username and password required')
+    
+    # Hashing (and its KDF thread pool) loads on the first login or register,
+    # so logout-only and preflight cold starts skip it
+    from concurrent.futures import TimeoutError as HashTimeout
+    from passwords import DUMMY_HASH, hash_password, verify_password
+    
+    try:
+        password_hash = hash_password(password) if action == 'register' else None
+    except HashTimeout:
+        return hashing_busy()
+    
+    try:
+        conn = getconn()
+    except Exception as e:
+        return error_response(500, 'Database connection failed')
+    
+    try:
+        if action == 'register':
+            display_name = body_data.get('display_name', username)
+            # Self-registration never grants a rank; officers assign it through bulk_register
+            role = 'Солдат'
+            
+            cur = conn.cursor()
+            cur.execute('''
+                INSERT INTO users (username, password_hash, display_name, role, last_active_at)
+                VALUES (%s, %s, %s, %s, NOW())
+                ON CONFLICT (username) DO NOTHING
+                RETURNING id, username, display_name, role, avatar
+            ''', (username, password_hash, display_name, role))
+            user_row = cur.fetchone()
+            
+            if not user_row:
+                conn.rollback()
+                cur.close()
+                return error_response(400, 'Username already exists')
+            
+            user = {
+                'id': user_row[0],
+                'username': user_row[1],
+                'display_name': user_row[2],
+                'role': user_row[3],
+                'avatar': user_row[4]
+            }
+            
+            conn.commit()
+            cur.close()
+
+            token = issue_token(user['id'], user['role'], user['display_name'])
+            
+            return json_response(event, 201, {
                 'user': user,
                 'token': token
-            })
-        }
-    
-    if action == 'login':
-        password_hash = hash_password(password)
-        safe_username = username.replace("'", "''")
+            }, cache='no-store')
+        
+        if action != 'login':
+            return error_response(400, 'Invalid action')
         
         cur = conn.cursor()
-        cur.execute(f'''
-            SELECT id, username, display_name, role, avatar
+        cur.execute('''
+            SELECT id, username, display_name, role, avatar, password_hash
             FROM users
-            WHERE username = '{safe_username}' AND password_hash = '{password_hash}'
-        ''')
+            WHERE username = %s
+        ''', (username,))
         user_row = cur.fetchone()
-        
         cur.close()
-        conn.close()
-        
-        if not user_row:
-            return {
-                'statusCode': 401,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Invalid credentials'})
-            }
-        
-        user = {
-            'id': user_row[0],
-            'username': user_row[1],
-            'display_name': user_row[2],
-            'role': user_row[3],
-            'avatar': user_row[4]
-        }
-        
-        token = generate_token()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({
-                'user': user,
-                'token': token
-            })
-        }
-    
-    return {
-        'statusCode': 400,
-        'headers': {'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Invalid action'})
-    }
\ No newline at end of file
+    finally:
+        putconn(conn)
+    
+    # The KDF runs with the connection back in the pool; only a rehash borrows one again
+    try:
+        matches, needs_rehash = verify_password(password, user_row[5] if user_row else DUMMY_HASH)
+    except HashTimeout:
+        return hashing_busy()
+    
+    if not user_row or not matches:
+        return error_response(401, 'Invalid credentials')
+    
+    if needs_rehash:
+        try:
+            rehashed = hash_password(password)
+        except HashTimeout:
+            rehashed = None  # the next login upgrades it
+        if rehashed:
+            conn = getconn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('UPDATE users SET password_hash = %s WHERE id = %s', (rehashed, user_row[0]))
+                conn.commit()
+            finally:
+                putconn(conn)
+    
+    user = {
+        'id': user_row[0],
+        'username': user_row[1],
+        'display_name': user_row[2],
+        'role': user_row[3],
+        'avatar': user_row[4]
+    }
+    
+    token = issue_token(user['id'], user['role'], user['display_name'])
+    
+    return json_response(event, 200, {
+        'user': user,
+        'token': token
+    }, cache='no-store')
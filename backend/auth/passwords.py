@@ -0,0 +1,105 @@
+'''
+Salted scrypt password hashing with per-hash cost parameters.
+
+Stored format: scrypt$<n>$<r>$<p>$<salt>$<hash> (base64url, no padding).
+Legacy unsalted SHA-256 hex digests still verify and are flagged for rehash.
+
+Run `python passwords.py --budget-ms 250` on the target hardware to pick
+PASSWORD_SCRYPT_N so that p99 hashing latency stays inside the budget.
+'''
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', '16384'))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', '1'))
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', '10'))
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='kdf')
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=2 * 128 * r * (n + p + 2), dklen=KEY_BYTES)
+
+
+def _hash(password: str) -> str:
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}'
+
+
+def _verify(password: str, stored: str) -> Tuple[bool, bool]:
+    if not stored.startswith('scrypt$'):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored), True
+
+    _, n, r, p, salt, key = stored.split('$')
+    n, r, p = int(n), int(r), int(p)
+    candidate = _scrypt(password, _b64decode(salt), n, r, p)
+    needs_rehash = (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return hmac.compare_digest(candidate, _b64decode(key)), needs_rehash
+
+
+def hash_password(password: str) -> str:
+    return _executor.submit(_hash, password).result(HASH_TIMEOUT)
+
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    batches = len(passwords) // HASH_WORKERS + 1
+    return list(_executor.map(_hash, passwords, timeout=HASH_TIMEOUT * batches))
+
+
+def verify_password(password: str, stored: str) -> Tuple[bool, bool]:
+    '''Return (matches, needs_rehash); runs on the KDF thread pool'''
+    return _executor.submit(_verify, password, stored).result(HASH_TIMEOUT)
+
+
+DUMMY_HASH = f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${"A" * 22}${"A" * 43}'
+
+
+def calibrate(budget_ms: float, samples: int = 20, r: int = SCRYPT_R, p: int = SCRYPT_P) -> int:
+    '''Largest power-of-two N whose p99 hashing latency fits the budget'''
+    best = 1024
+    n = 1024
+    while n <= 1 << 20:
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            _scrypt('calibration-password', secrets.token_bytes(SALT_BYTES), n, r, p)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        print(f'N={n:>8}  p50={timings[len(timings) // 2]:8.1f} ms  p99={p99:8.1f} ms')
+        if p99 > budget_ms:
+            break
+        best = n
+        n *= 2
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pick scrypt cost for a login latency budget')
+    parser.add_argument('--budget-ms', type=float, default=250.0)
+    parser.add_argument('--samples', type=int, default=20)
+    args = parser.parse_args()
+    n = calibrate(args.budget_ms, args.samples)
+    print(f'PASSWORD_SCRYPT_N={n} PASSWORD_SCRYPT_R={SCRYPT_R} PASSWORD_SCRYPT_P={SCRYPT_P}')
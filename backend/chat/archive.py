@@ -0,0 +1,272 @@
+'''
+Monthly partition upkeep and cold-history archival for chat messages.
+
+messages is range-partitioned by month on created_at (messages_YYYY_MM).
+Maintenance keeps PARTITION_MONTHS_AHEAD future partitions created. Rows for
+a month without a partition land in messages_default, and are moved into the
+month's partition when maintenance creates it. Maintenance also
+detaches partitions older than MESSAGES_HOT_MONTHS, streams each into a
+gzip NDJSON file under MESSAGE_ARCHIVE_DIR and drops it only after the
+archive is fully written and recorded in message_archives.
+
+MESSAGE_ARCHIVE_DIR must be durable storage shared by every instance (a
+mounted network volume, not a function instance's local disk): the month is
+dropped from the database once its file is written, and GET ?archive= reads
+the file on whichever instance serves the request. Without it maintenance
+leaves cold months attached and logs a warning.
+
+    python archive.py read 2024-01        # print an archived month as NDJSON
+    python archive.py restore 2024-01     # re-attach an archived month as a partition
+'''
+import argparse
+import gzip
+import json
+import os
+import sys
+from collections import deque
+from datetime import date, datetime, timezone
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from db import getconn, putconn
+
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', '3'))
+MESSAGES_HOT_MONTHS = int(os.environ.get('MESSAGES_HOT_MONTHS', '6'))
+MESSAGE_ARCHIVE_DIR = os.environ.get('MESSAGE_ARCHIVE_DIR', '')
+ARCHIVE_FETCH_SIZE = 2000
+
+ARCHIVE_COLUMNS = ['id', 'author', 'avatar', 'content', 'role', 'created_at']
+STORED_COLUMNS = ARCHIVE_COLUMNS + ['deleted_at']
+DEFAULT_PARTITION = 'messages_default'
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'messages_{month.year:04d}_{month.month:02d}'
+
+
+def parse_month(value: str) -> date:
+    '''YYYY-MM to the first day of that month; raises ValueError'''
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def archive_path(month: date) -> str:
+    if not MESSAGE_ARCHIVE_DIR:
+        raise FileNotFoundError('MESSAGE_ARCHIVE_DIR is not set')
+    return os.path.join(MESSAGE_ARCHIVE_DIR, f'{partition_name(month)}.ndjson.gz')
+
+
+def _partition_months(conn, attached: bool) -> List[date]:
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT relname
+            FROM pg_class
+            WHERE relkind = 'r' AND relispartition = %s AND relname ~ '^messages_[0-9]{4}_[0-9]{2}$'
+        ''', (attached,))
+        return sorted(datetime.strptime(row[0], 'messages_%Y_%m').date() for row in cur.fetchall())
+
+
+def attached_partitions(conn) -> List[date]:
+    return _partition_months(conn, True)
+
+
+def detached_partitions(conn) -> List[date]:
+    '''Months detached by an earlier run whose export did not finish'''
+    return _partition_months(conn, False)
+
+
+def create_partition(cur, month: date) -> None:
+    '''
+    Attach a partition for month, first moving in any of its rows that were
+    parked in the default partition; attaching over a default partition that
+    still held them would fail its constraint check.
+    '''
+    table = sql.Identifier(partition_name(month))
+    columns = sql.SQL(', ').join(map(sql.Identifier, STORED_COLUMNS))
+    cur.execute(sql.SQL('CREATE TABLE IF NOT EXISTS {} (LIKE messages INCLUDING DEFAULTS INCLUDING GENERATED)').format(table))
+    cur.execute(sql.SQL('''
+        WITH moved AS (
+            DELETE FROM {} WHERE created_at >= %s AND created_at < %s
+            RETURNING {}
+        )
+        INSERT INTO {} ({}) SELECT {} FROM moved
+    ''').format(sql.Identifier(DEFAULT_PARTITION), columns, table, columns, columns), (month, add_months(month, 1)))
+    cur.execute(sql.SQL('ALTER TABLE messages ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)').format(table),
+                (month, add_months(month, 1)))
+
+
+def ensure_partitions(conn, today: date) -> List[str]:
+    '''
+    Create the current month's partition and PARTITION_MONTHS_AHEAD after it,
+    plus one for every month that has rows waiting in the default partition
+    '''
+    existing = set(attached_partitions(conn))
+    current = today.replace(day=1)
+    created = []
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("SELECT DISTINCT DATE_TRUNC('month', created_at)::date FROM {}").format(
+            sql.Identifier(DEFAULT_PARTITION)))
+        months = {row[0] for row in cur.fetchall()}
+        months.update(add_months(current, offset) for offset in range(PARTITION_MONTHS_AHEAD + 1))
+        for month in sorted(months):
+            if month in existing:
+                continue
+            create_partition(cur, month)
+            created.append(partition_name(month))
+    conn.commit()
+    return created
+
+
+def _fsync(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def archive_partition(conn, month: date, detach: bool = True) -> Dict[str, Any]:
+    '''Detach one month, stream its live rows to gzip NDJSON, record it and drop the table'''
+    table = sql.Identifier(partition_name(month))
+    if detach:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL('ALTER TABLE messages DETACH PARTITION {}').format(table))
+        conn.commit()
+
+    os.makedirs(MESSAGE_ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(month)
+    partial = path + '.partial'
+    rows = 0
+    with conn.cursor(name=f'archive_{partition_name(month)}') as cur:
+        cur.itersize = ARCHIVE_FETCH_SIZE
+        cur.execute(sql.SQL('SELECT {} FROM {} WHERE deleted_at IS NULL ORDER BY id').format(
+            sql.SQL(', ').join(map(sql.Identifier, ARCHIVE_COLUMNS)), table))
+        with gzip.open(partial, 'wt', encoding='utf-8') as archive:
+            for row in cur:
+                record = dict(zip(ARCHIVE_COLUMNS, row))
+                record['created_at'] = record['created_at'].isoformat()
+                archive.write(json.dumps(record, ensure_ascii=False) + '\n')
+                rows += 1
+    # The partition is dropped next, so the archive must be durable first: file data, then its name
+    _fsync(partial)
+    os.replace(partial, path)
+    _fsync(MESSAGE_ARCHIVE_DIR)
+
+    with conn.cursor() as cur:
+        cur.execute('''
+            INSERT INTO message_archives (month, path, row_count)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (month) DO UPDATE SET path = EXCLUDED.path, row_count = EXCLUDED.row_count,
+                                              archived_at = NOW()
+        ''', (month, path, rows))
+        cur.execute(sql.SQL('DROP TABLE {}').format(table))
+    conn.commit()
+    return {'month': month.isoformat()[:7], 'rows': rows, 'path': path}
+
+
+def archive_cold_partitions(conn, today: date) -> List[Dict[str, Any]]:
+    if not MESSAGE_ARCHIVE_DIR:
+        print(json.dumps({'chat_archive': 'MESSAGE_ARCHIVE_DIR not set, cold months left in place'}))
+        return []
+    cutoff = add_months(today.replace(day=1), -MESSAGES_HOT_MONTHS)
+    archived = [archive_partition(conn, month, detach=False) for month in detached_partitions(conn)]
+    archived += [archive_partition(conn, month) for month in attached_partitions(conn) if month < cutoff]
+    return archived
+
+
+def archived_months(conn) -> List[Dict[str, Any]]:
+    with conn.cursor() as cur:
+        cur.execute("SELECT TO_CHAR(month, 'YYYY-MM'), row_count FROM message_archives ORDER BY month")
+        return [{'month': row[0], 'rows': row[1]} for row in cur.fetchall()]
+
+
+def read_archive(month: date) -> Iterator[Dict[str, Any]]:
+    '''Stream an archived month's messages in id order; FileNotFoundError if never archived or no archive dir'''
+    with gzip.open(archive_path(month), 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            yield json.loads(line)
+
+
+def read_archive_page(month: date, before: Optional[int], limit: int) -> Dict[str, Any]:
+    '''Page of an archived month before the id cursor, in id order like chat history pages'''
+    window: Deque[Dict[str, Any]] = deque(maxlen=limit)
+    matched = 0
+    for message in read_archive(month):
+        if before is not None and message['id'] >= before:
+            break
+        window.append(message)
+        matched += 1
+    messages = list(window)
+    for message in messages:
+        message['timestamp'] = message['created_at'][11:16]
+    return {
+        'month': month.isoformat()[:7],
+        'messages': messages,
+        'cursor': {'before': messages[0]['id'] if messages else before},
+        'has_more': matched > limit
+    }
+
+
+def restore_archive(conn, month: date) -> int:
+    '''
+    Load an archived month back into messages as a re-attached partition.
+    Maintenance archives it again on its next run while it is older than
+    MESSAGES_HOT_MONTHS.
+    '''
+    table = sql.Identifier(partition_name(month))
+    insert = sql.SQL('INSERT INTO {} ({}) VALUES %s').format(
+        table, sql.SQL(', ').join(map(sql.Identifier, ARCHIVE_COLUMNS)))
+    rows = 0
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL('CREATE TABLE {} (LIKE messages INCLUDING DEFAULTS INCLUDING GENERATED)').format(table))
+        batch = []
+        for message in read_archive(month):
+            batch.append([message[column] for column in ARCHIVE_COLUMNS])
+            if len(batch) >= ARCHIVE_FETCH_SIZE:
+                execute_values(cur, insert.as_string(conn), batch, page_size=ARCHIVE_FETCH_SIZE)
+                rows += len(batch)
+                batch = []
+        if batch:
+            execute_values(cur, insert.as_string(conn), batch, page_size=ARCHIVE_FETCH_SIZE)
+            rows += len(batch)
+        cur.execute(sql.SQL('ALTER TABLE messages ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)').format(table),
+                    (month, add_months(month, 1)))
+        cur.execute('DELETE FROM message_archives WHERE month = %s', (month,))
+    conn.commit()
+    return rows
+
+
+def run_maintenance(today: Optional[date] = None) -> Dict[str, Any]:
+    today = today or datetime.now(timezone.utc).date()
+    conn = getconn()
+    try:
+        created = ensure_partitions(conn, today)
+        archived = archive_cold_partitions(conn, today)
+    finally:
+        putconn(conn)
+    return {'created_partitions': created, 'archived': archived}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read or restore archived chat months')
+    parser.add_argument('command', choices=['read', 'restore', 'maintain'])
+    parser.add_argument('month', nargs='?', help='YYYY-MM')
+    args = parser.parse_args()
+
+    if args.command == 'maintain':
+        print(json.dumps(run_maintenance(), ensure_ascii=False))
+    elif args.command == 'read':
+        for message in read_archive(parse_month(args.month)):
+            sys.stdout.write(json.dumps(message, ensure_ascii=False) + '\n')
+    else:
+        conn = getconn()
+        try:
+            print(f'Restored {restore_archive(conn, parse_month(args.month))} messages')
+        finally:
+            putconn(conn)
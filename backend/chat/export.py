@@ -0,0 +1,144 @@
+'''
+Streaming export of the chat log for after-action reviews.
+
+Rows are read through a named (server-side) cursor EXPORT_FETCH_SIZE at a
+time and encoded into NDJSON or CSV chunks of about EXPORT_CHUNK_BYTES, so
+memory stays flat whatever the size of history. The function response is
+still assembled in memory, so one export covers at most EXPORT_MAX_ROWS rows
+and about EXPORT_MAX_BYTES of uncompressed output (one chunk over at most);
+the caller continues from last_id with after_id.
+
+    python export.py --format csv --from 2024-05-01 --to 2024-06-01 > may.csv
+'''
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from db import getconn, putconn
+
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '2000'))
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_MAX_ROWS = int(os.environ.get('EXPORT_MAX_ROWS', '100000'))
+EXPORT_MAX_BYTES = int(os.environ.get('EXPORT_MAX_BYTES', str(2 * 1024 * 1024)))
+
+EXPORT_COLUMNS = ['id', 'author', 'role', 'content', 'created_at']
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+class ChatExport:
+    '''Iterate to get encoded chunks; rows, bytes, last_id and truncated are set as it runs'''
+
+    def __init__(self, conn, fmt: str = 'ndjson', since: Optional[datetime] = None,
+                 until: Optional[datetime] = None, author: Optional[str] = None, role: Optional[str] = None,
+                 after_id: int = 0, max_rows: int = EXPORT_MAX_ROWS, max_bytes: int = EXPORT_MAX_BYTES,
+                 header: bool = True):
+        if fmt not in CONTENT_TYPES:
+            raise ValueError(f'format must be one of {", ".join(CONTENT_TYPES)}')
+        self.conn = conn
+        self.fmt = fmt
+        self.content_type = CONTENT_TYPES[fmt]
+        self.since = since
+        self.until = until
+        self.author = author
+        self.role = role
+        self.after_id = after_id
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.header = header
+        self.rows = 0
+        self.bytes = 0
+        self.last_id = after_id
+        self.truncated = False
+
+    def _query(self):
+        conditions = ['id > %s', 'deleted_at IS NULL']
+        values: List = [self.after_id]
+        if self.since:
+            conditions.append('created_at >= %s')
+            values.append(self.since)
+        if self.until:
+            conditions.append('created_at < %s')
+            values.append(self.until)
+        if self.author:
+            conditions.append('author = %s')
+            values.append(self.author)
+        if self.role:
+            conditions.append('role = %s')
+            values.append(self.role)
+        values.append(self.max_rows + 1)
+        return f'''
+            SELECT {', '.join(EXPORT_COLUMNS)}
+            FROM messages
+            WHERE {' AND '.join(conditions)}
+            ORDER BY id
+            LIMIT %s
+        ''', values
+
+    def __iter__(self) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if self.fmt == 'csv' else None
+        if writer and self.header:
+            writer.writerow(EXPORT_COLUMNS)
+
+        query, values = self._query()
+        with self.conn.cursor(name='chat_export') as cur:
+            cur.itersize = EXPORT_FETCH_SIZE
+            cur.execute(query, values)
+            for row in cur:
+                if self.rows == self.max_rows or self.bytes >= self.max_bytes:
+                    self.truncated = True
+                    break
+                record = dict(zip(EXPORT_COLUMNS, row))
+                record['created_at'] = record['created_at'].isoformat()
+                if writer:
+                    writer.writerow([record[column] for column in EXPORT_COLUMNS])
+                else:
+                    buffer.write(json.dumps(record, ensure_ascii=False))
+                    buffer.write('\n')
+                self.rows += 1
+                self.last_id = record['id']
+
+                if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                    chunk = buffer.getvalue().encode()
+                    self.bytes += len(chunk)
+                    yield chunk
+                    buffer.seek(0)
+                    buffer.truncate()
+        self.conn.rollback()
+
+        if buffer.tell():
+            chunk = buffer.getvalue().encode()
+            self.bytes += len(chunk)
+            yield chunk
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the chat log as NDJSON or CSV')
+    parser.add_argument('--format', choices=list(CONTENT_TYPES), default='ndjson')
+    parser.add_argument('--from', dest='since', type=datetime.fromisoformat)
+    parser.add_argument('--to', dest='until', type=datetime.fromisoformat)
+    parser.add_argument('--author')
+    parser.add_argument('--role')
+    args = parser.parse_args()
+
+    conn = getconn()
+    try:
+        after_id = 0
+        while True:
+            export = ChatExport(conn, args.format, args.since, args.until, args.author, args.role,
+                                after_id, header=after_id == 0)
+            for chunk in export:
+                sys.stdout.buffer.write(chunk)
+            if not export.truncated:
+                break
+            after_id = export.last_id
+    finally:
+        putconn(conn)
@@ -1,122 +1,243 @@
 import json
-import os
+import select
+import time
+from datetime import datetime
 from typing import Dict, Any
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from chat_queries import (MAX_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE, chat_etag, fetch_chat_page, fetch_chat_state,
+                          lock_delta_writes, search_messages)
+from db import getconn, listen, putconn, warmup
+from instrument import instrumented, phase
+from ratelimit import check_local, consume, too_many_requests
+from response import error_response, json_response, not_modified, preflight, request_header, stream_response
+from tokens import authenticate
+
+warmup()
+
+LONG_POLL_MAX_WAIT = 25.0
+NOTIFY_CHANNEL = 'chat_messages'
+MAX_SEARCH_QUERY_LENGTH = 200
+
+def wait_for_notify(conn, timeout: float) -> bool:
+    '''Block until a NOTIFY arrives on a LISTENing connection or the timeout passes'''
+    with phase('wait'):
+        ready = select.select([conn], [], [], timeout)
+    if ready == ([], [], []):
+        return False
+    conn.poll()
+    received = bool(conn.notifies)
+    conn.notifies.clear()
+    return received
+
+def maintenance(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Periodic chat maintenance - create upcoming monthly partitions, archive cold months to MESSAGE_ARCHIVE_DIR (skipped when unset), purge old tombstones
+    Args: event from the scheduled trigger
+    Returns: HTTP response with the created partitions and archived months
+    '''
+    from archive import run_maintenance
+    from moderation import purge_tombstones
+    
+    result = run_maintenance()
+    result['purged_tombstones'] = purge_tombstones()
+    print(json.dumps({'chat_maintenance': result}, ensure_ascii=False))
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'isBase64Encoded': False,
+        'body': json.dumps(result, ensure_ascii=False)
+    }
+
+@instrumented('chat')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Handle chat messages - get history, send new messages, delete messages (officers only)
+    Business: Handle chat messages - get history, full-text search, read archived months, export (officers only), send new messages, bulk soft-delete messages (officers only)
     Args: event with httpMethod, body, queryStringParameters
     Returns: HTTP response with messages list or success status
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-User-Role',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+        return preflight('GET, POST, DELETE, OPTIONS', 'Content-Type, Authorization, If-None-Match, X-Primary-Until')
     
-    if method == 'GET':
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute('''
-                SELECT id, author, avatar, content, role, 
-                       TO_CHAR(created_at, 'HH24:MI') as timestamp
-                FROM messages 
-                ORDER BY created_at ASC
-            ''')
-            messages = cur.fetchall()
-        
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({'messages': messages})
-        }
+    claims = authenticate(event)
+    if method in ('POST', 'DELETE') and not claims:
+        return error_response(401, 'Valid token required')
     
     if method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        author = body_data.get('author', 'Unknown')
-        content = body_data.get('content', '')
-        role = body_data.get('role', 'Солдат')
-        avatar = body_data.get('avatar', '/placeholder.svg')
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute('''
-                INSERT INTO messages (author, avatar, content, role)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, author, avatar, content, role,
-                          TO_CHAR(created_at, 'HH24:MI') as timestamp
-            ''', (author, avatar, content, role))
-            new_message = cur.fetchone()
-            conn.commit()
-        
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({'message': new_message})
-        }
+        retry_after = check_local('chat.post', str(claims['uid']))
+        if retry_after:
+            return too_many_requests(retry_after)
     
-    if method == 'DELETE':
-        headers = event.get('headers', {})
-        user_role = headers.get('x-user-role', headers.get('X-User-Role', ''))
-        
-        if user_role != 'Офицер':
-            return {
-                'statusCode': 403,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Only officers can delete messages'})
-            }
-        
-        params = event.get('queryStringParameters', {})
-        message_id = params.get('message_id')
+    params = event.get('queryStringParameters') or {}
+    # LISTEN/NOTIFY is not replicated, so long-polls stay on the primary
+    read_only = method == 'GET' and params.get('wait', '0') in ('', '0')
+    conn = getconn(read_only, event)
+    
+    try:
+        if method == 'GET':
+            
+            if 'export' in params:
+                if not claims or claims['role'] != 'Офицер':
+                    return error_response(403, 'Only officers can export the chat log')
+                from export import ChatExport
+                try:
+                    export = ChatExport(
+                        conn,
+                        params['export'] or 'ndjson',
+                        datetime.fromisoformat(params['from']) if 'from' in params else None,
+                        datetime.fromisoformat(params['to']) if 'to' in params else None,
+                        params.get('author'),
+                        params.get('role'),
+                        int(params.get('after_id', 0))
+                    )
+                except ValueError as e:
+                    return error_response(400, f'Invalid export parameters: {e}')
+                
+                response = stream_response(event, 200, export, export.content_type, {
+                    'Content-Disposition': f'attachment; filename="chat-export.{export.fmt}"',
+                    'Access-Control-Expose-Headers': 'Content-Disposition, X-Export-Rows, X-Export-Next-After, Server-Timing'
+                })
+                response['headers']['X-Export-Rows'] = str(export.rows)
+                if export.truncated:
+                    response['headers']['X-Export-Next-After'] = str(export.last_id)
+                return response
+            
+            if 'archive' in params:
+                from archive import archived_months, parse_month, read_archive_page
+                if not params['archive']:
+                    return json_response(event, 200, {'archives': archived_months(conn)}, cache='short')
+                try:
+                    month = parse_month(params['archive'])
+                    limit = max(1, min(int(params.get('limit', 50)), MAX_PAGE_SIZE))
+                    before = int(params['before']) if 'before' in params else None
+                except ValueError:
+                    return error_response(400, 'archive must be YYYY-MM, limit and before integers')
+                try:
+                    page = read_archive_page(month, before, limit)
+                except FileNotFoundError:
+                    return error_response(404, f'No archive for {params["archive"]}')
+                return json_response(event, 200, page, cache='static')
+            
+            if 'q' in params:
+                query = params['q'].strip()
+                if not query or len(query) > MAX_SEARCH_QUERY_LENGTH:
+                    return error_response(400, f'q must be 1-{MAX_SEARCH_QUERY_LENGTH} characters')
+                try:
+                    limit = max(1, min(int(params.get('limit', 20)), MAX_SEARCH_PAGE_SIZE))
+                    before = int(params['before']) if 'before' in params else None
+                    since = datetime.fromisoformat(params['from']) if 'from' in params else None
+                    until = datetime.fromisoformat(params['to']) if 'to' in params else None
+                except ValueError:
+                    return error_response(400, 'limit and before must be integers, from and to ISO timestamps')
+                
+                results = search_messages(conn, query, params.get('author'), params.get('role'),
+                                          since, until, before, limit)
+                return json_response(event, 200, results, cache='revalidate')
+            
+            since_id = params.get('since_id', params.get('after'))
+            before = params.get('before')
+            deleted_since = params.get('deleted_since')
+            
+            try:
+                limit = max(0, min(int(params.get('limit', 0)), MAX_PAGE_SIZE))
+                wait = max(0.0, min(float(params.get('wait', 0)), LONG_POLL_MAX_WAIT))
+                since_id = int(since_id) if since_id is not None else None
+                before = int(before) if before is not None else None
+                deleted_since = int(deleted_since) if deleted_since is not None else 0
+            except ValueError:
+                return error_response(400, 'since_id, before, deleted_since, limit and wait must be numbers')
+            
+            conn.autocommit = True
+            if wait:
+                listen(conn, NOTIFY_CHANNEL)
+            
+            if_none_match = request_header(event, 'If-None-Match')
+            deadline = time.monotonic() + wait
+            
+            while True:
+                state = fetch_chat_state(conn)
+                last_message_id, last_deletion_id = state
+                etag = chat_etag(state)
+                
+                unchanged = if_none_match == etag or (
+                    since_id is not None
+                    and since_id >= last_message_id
+                    and deleted_since >= last_deletion_id
+                )
+                remaining = deadline - time.monotonic()
+                if not unchanged or remaining <= 0 or not wait_for_notify(conn, remaining):
+                    break
+            
+            if unchanged and if_none_match == etag:
+                return not_modified(etag, 'revalidate')
+            
+            page = fetch_chat_page(conn, state, since_id, before, deleted_since, limit)
+            
+            return json_response(event, 200, page, cache='revalidate', etag=etag)
         
-        if not message_id:
-            return {
-                'statusCode': 400,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'message_id required'})
-            }
+        if method == 'POST':
+            retry_after = consume(conn, 'chat.post', str(claims['uid']))
+            if retry_after:
+                return too_many_requests(retry_after)
+            
+            body_data = json.loads(event.get('body', '{}'))
+            author = claims['name']
+            content = body_data.get('content', '')
+            role = claims['role']
+            avatar = body_data.get('avatar', '/placeholder.svg')
+            
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                lock_delta_writes(cur, 'messages')
+                cur.execute('''
+                    INSERT INTO messages (author, avatar, content, role)
+                    VALUES (%s, %s, %s, %s)
+                    RETURNING id, author, avatar, content, role,
+                              TO_CHAR(created_at, 'HH24:MI') as timestamp
+                ''', (author, avatar, content, role))
+                new_message = cur.fetchone()
+                cur.execute('UPDATE users SET last_active_at = NOW() WHERE id = %s', (claims['uid'],))
+                cur.execute('SELECT pg_notify(%s, %s)', (NOTIFY_CHANNEL, str(new_message['id'])))
+                conn.commit()
+
+            return json_response(event, 201, {'message': new_message}, cache='no-store')
         
-        with conn.cursor() as cur:
-            cur.execute('DELETE FROM messages WHERE id = %s', (message_id,))
+        if method == 'DELETE':
+            if claims['role'] != 'Офицер':
+                return error_response(403, 'Only officers can delete messages')
+            from moderation import MAX_BULK_IDS, soft_delete
+            
+            try:
+                body_data = json.loads(event.get('body') or '{}')
+                if not isinstance(body_data, dict):
+                    raise ValueError('body must be a JSON object')
+                message_ids = body_data.get('message_ids')
+                if params.get('message_id'):
+                    message_ids = [params['message_id']]
+                if message_ids is not None:
+                    message_ids = [int(message_id) for message_id in message_ids]
+                    if not message_ids or len(message_ids) > MAX_BULK_IDS:
+                        return error_response(400, f'message_ids must hold 1-{MAX_BULK_IDS} ids')
+                since = datetime.fromisoformat(body_data['from']) if body_data.get('from') else None
+                until = datetime.fromisoformat(body_data['to']) if body_data.get('to') else None
+                deleted = soft_delete(conn, message_ids, body_data.get('author'), since, until)
+            except (TypeError, ValueError) as e:
+                return error_response(400, f'Invalid moderation filter: {e}')
+            
+            if deleted:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT pg_notify(%s, %s)', (NOTIFY_CHANNEL, str(deleted[-1])))
             conn.commit()
+            
+            # A full batch may leave more matches; repeating the same request continues from there
+            return json_response(event, 200, {
+                'success': True,
+                'deleted': deleted,
+                'has_more': message_ids is None and len(deleted) >= MAX_BULK_IDS
+            }, cache='no-store')
         
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({'success': True})
-        }
-    
-    return {
-        'statusCode': 405,
-        'headers': {'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+        return error_response(405, 'Method not allowed')
+    finally:
+        putconn(conn)
@@ -0,0 +1,157 @@
+'''
+Per-invocation instrumentation: query count and DB time via a traced cursor,
+connect/serialize/total phases, a Server-Timing header and one structured
+log line per sampled invocation, plus slow-query logging with redacted
+parameters.
+Vendored into every backend/<function>/ next to db.py; keep the copies identical.
+'''
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import psycopg2.extensions
+
+SAMPLE_RATE = float(os.environ.get('INSTRUMENT_SAMPLE_RATE', '1.0'))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+
+_local = threading.local()
+_whitespace = re.compile(r'\s+')
+
+
+class Trace:
+    def __init__(self, function: str):
+        self.function = function
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.phases: Dict[str, float] = {}
+
+    def add_phase(self, name: str, elapsed_ms: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed_ms
+
+    def server_timing(self, total_ms: float) -> str:
+        metrics = [f'db;dur={self.db_ms:.1f};desc="{self.queries} queries"']
+        metrics += [f'{name};dur={elapsed:.1f}' for name, elapsed in self.phases.items()]
+        metrics.append(f'total;dur={total_ms:.1f}')
+        return ', '.join(metrics)
+
+
+def current_trace() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_phase(name, (time.perf_counter() - started) * 1000)
+
+
+def _redacted(params: Any) -> Any:
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [type(value).__name__ for value in params]
+    return type(params).__name__
+
+
+def _record(sql: Any, params: Any, elapsed_ms: float) -> None:
+    trace = current_trace()
+    if trace is not None:
+        trace.queries += 1
+        trace.db_ms += elapsed_ms
+    if elapsed_ms >= SLOW_QUERY_MS:
+        text = sql.decode() if isinstance(sql, bytes) else str(sql)
+        print(json.dumps({
+            'slow_query': _whitespace.sub(' ', text).strip()[:2000],
+            'params': _redacted(params),
+            'ms': round(elapsed_ms, 1),
+            'function': trace.function if trace else None,
+        }, ensure_ascii=False))
+
+
+_cursor_classes: Dict[type, type] = {}
+
+
+def _traced_cursor(base: type) -> type:
+    if base not in _cursor_classes:
+        class TracedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    _record(query, vars, (time.perf_counter() - started) * 1000)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    _record(query, None, (time.perf_counter() - started) * 1000)
+
+            def copy_expert(self, sql, file, size=8192):
+                started = time.perf_counter()
+                try:
+                    return super().copy_expert(sql, file, size)
+                finally:
+                    _record(sql, None, (time.perf_counter() - started) * 1000)
+
+        _cursor_classes[base] = TracedCursor
+    return _cursor_classes[base]
+
+
+class TracedConnection(psycopg2.extensions.connection):
+    '''Connection factory whose cursors, whatever their cursor_factory, report into the current trace'''
+
+    def cursor(self, *args, **kwargs):
+        kwargs['cursor_factory'] = _traced_cursor(kwargs.get('cursor_factory') or psycopg2.extensions.cursor)
+        return super().cursor(*args, **kwargs)
+
+
+def instrumented(function: str) -> Callable:
+    '''Decorate a handler: trace a sampled share of invocations and attach Server-Timing'''
+    def decorate(handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if SAMPLE_RATE <= 0 or random.random() >= SAMPLE_RATE:
+                return handler(event, context)
+
+            trace = Trace(function)
+            _local.trace = trace
+            status = 500
+            try:
+                response = handler(event, context)
+                status = response.get('statusCode', 200)
+                total_ms = (time.perf_counter() - trace.started) * 1000
+                response.setdefault('headers', {})['Server-Timing'] = trace.server_timing(total_ms)
+                return response
+            finally:
+                _local.trace = None
+                total_ms = (time.perf_counter() - trace.started) * 1000
+                print(json.dumps({
+                    'invocation': function,
+                    'method': event.get('httpMethod', 'GET'),
+                    'action': (event.get('queryStringParameters') or {}).get('action'),
+                    'status': status,
+                    'queries': trace.queries,
+                    'db_ms': round(trace.db_ms, 1),
+                    **{f'{name}_ms': round(elapsed, 1) for name, elapsed in trace.phases.items()},
+                    'total_ms': round(total_ms, 1),
+                }))
+        return wrapper
+    return decorate
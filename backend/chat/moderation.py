@@ -0,0 +1,94 @@
+'''
+Bulk moderation for chat: soft-delete by id list, author or time range in
+one statement, and a batched purge of tombstones past retention.
+
+A filter delete tombstones at most MAX_BULK_IDS messages, lowest ids first,
+so one call never rewrites an unbounded slice of the table; callers repeat
+the same filter until it reports nothing more to delete.
+
+A soft delete sets messages.deleted_at and appends to message_deletions in
+the same statement, so delta-polling clients drop the rows incrementally.
+'''
+import os
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from chat_queries import lock_delta_writes
+from db import getconn, putconn
+
+MAX_BULK_IDS = 1000
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '30'))
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', '1000'))
+PURGE_TIME_BUDGET = float(os.environ.get('PURGE_TIME_BUDGET', '20'))
+
+
+def soft_delete(conn, message_ids: Optional[List[int]] = None, author: Optional[str] = None,
+                since: Optional[datetime] = None, until: Optional[datetime] = None,
+                limit: int = MAX_BULK_IDS) -> List[int]:
+    '''Tombstone up to limit live messages matching all given filters, lowest ids first; returns their ids'''
+    conditions = ['deleted_at IS NULL']
+    values: List = []
+    if message_ids is not None:
+        conditions.append('id = ANY(%s)')
+        values.append(message_ids)
+    if author:
+        conditions.append('author = %s')
+        values.append(author)
+    if since:
+        conditions.append('created_at >= %s')
+        values.append(since)
+    if until:
+        conditions.append('created_at < %s')
+        values.append(until)
+    if len(conditions) == 1:
+        raise ValueError('at least one of message_ids, author, from or to is required')
+    
+    values.append(limit)
+    
+    with conn.cursor() as cur:
+        lock_delta_writes(cur, 'message_deletions')
+        cur.execute(f'''
+            WITH batch AS (
+                SELECT id FROM messages
+                WHERE {' AND '.join(conditions)}
+                ORDER BY id
+                LIMIT %s
+            ), tombstoned AS (
+                UPDATE messages SET deleted_at = NOW()
+                WHERE id IN (SELECT id FROM batch) AND deleted_at IS NULL
+                RETURNING id
+            ), logged AS (
+                INSERT INTO message_deletions (message_id)
+                SELECT id FROM tombstoned ORDER BY id
+            )
+            SELECT id FROM tombstoned ORDER BY id
+        ''', values)
+        return [row[0] for row in cur.fetchall()]
+
+
+def purge_tombstones() -> int:
+    '''Hard-delete tombstones older than retention in PURGE_BATCH_SIZE batches, one commit each'''
+    purged = 0
+    deadline = time.monotonic() + PURGE_TIME_BUDGET
+    conn = getconn()
+    try:
+        while time.monotonic() < deadline:
+            with conn.cursor() as cur:
+                cur.execute(f'''
+                    DELETE FROM messages
+                    WHERE (id, created_at) IN (
+                        SELECT id, created_at
+                        FROM messages
+                        WHERE deleted_at < NOW() - INTERVAL '{TOMBSTONE_RETENTION_DAYS} days'
+                        LIMIT %s
+                    )
+                ''', (PURGE_BATCH_SIZE,))
+                batch = cur.rowcount
+            conn.commit()
+            purged += batch
+            if batch < PURGE_BATCH_SIZE:
+                break
+    finally:
+        putconn(conn)
+    return purged
@@ -0,0 +1,105 @@
+'''
+Token-bucket admission control keyed by user and route.
+
+The authoritative buckets live in the UNLOGGED rate_limit_buckets table and
+are refilled and debited by a single upsert, so every instance sees the same
+budget. Each instance keeps the last known state of its buckets and refills
+it locally, which lets it reject an empty bucket before touching the pool.
+
+Every bucket is keyed by the verified token's user id: chat POST and all
+voice POSTs require a token, and client-chosen ids such as peer ids never
+key a bucket, since a caller could rotate them to get a fresh one.
+Vendored into backend/chat/ and backend/voice/; keep the copies identical.
+'''
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from response import error_response
+
+DEFAULT_LIMITS = {
+    'chat.post': '10:1',
+    'voice.join': '5:0.2',
+    'voice.signal': '120:20',
+}
+LOCAL_BUCKETS = int(os.environ.get('RATE_LIMIT_LOCAL_BUCKETS', '4096'))
+
+
+def _limit(route: str) -> Tuple[float, float]:
+    '''(capacity, tokens per second) from RATE_LIMIT_<ROUTE>="capacity:rate", e.g. RATE_LIMIT_CHAT_POST=10:1'''
+    value = os.environ.get('RATE_LIMIT_' + route.replace('.', '_').upper(), DEFAULT_LIMITS[route])
+    capacity, rate = value.split(':')
+    return float(capacity), float(rate)
+
+
+LIMITS: Dict[str, Tuple[float, float]] = {route: _limit(route) for route in DEFAULT_LIMITS}
+
+_local: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+_lock = threading.Lock()
+
+
+def _retry_after(tokens: float, rate: float, cost: float = 1) -> float:
+    return (cost - tokens) / rate if rate > 0 else 3600.0
+
+
+def check_local(route: str, key: str, cost: float = 1) -> float:
+    '''Seconds to wait if this instance already knows the bucket holds fewer than cost tokens, else 0; never queries'''
+    capacity, rate = LIMITS[route]
+    with _lock:
+        known = _local.get(f'{route}:{key}')
+    if known is None:
+        return 0.0
+    tokens, seen_at = known
+    tokens = min(capacity, tokens + (time.monotonic() - seen_at) * rate)
+    return 0.0 if tokens >= cost else _retry_after(tokens, rate, cost)
+
+
+def consume(conn, route: str, key: str, cost: float = 1) -> float:
+    '''
+    Take cost tokens from the shared bucket (one per request, or one per item
+    for routes that batch) and commit straight away, so the bucket row lock is
+    not held through the caller's own transaction.
+    Returns 0 when admitted, otherwise the seconds until cost tokens are available.
+    '''
+    capacity, rate = LIMITS[route]
+    bucket = f'{route}:{key}'
+    with conn.cursor() as cur:
+        cur.execute('''
+            INSERT INTO rate_limit_buckets AS b (bucket, tokens, admitted, updated_at)
+            VALUES (%(bucket)s, %(capacity)s - CASE WHEN %(capacity)s >= %(cost)s THEN %(cost)s ELSE 0 END,
+                    %(capacity)s >= %(cost)s, clock_timestamp())
+            ON CONFLICT (bucket) DO UPDATE SET
+                admitted = LEAST(%(capacity)s, b.tokens
+                    + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * %(rate)s) >= %(cost)s,
+                tokens = LEAST(%(capacity)s, b.tokens
+                    + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * %(rate)s)
+                    - CASE WHEN LEAST(%(capacity)s, b.tokens
+                        + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * %(rate)s) >= %(cost)s THEN %(cost)s ELSE 0 END,
+                updated_at = clock_timestamp()
+            RETURNING tokens, admitted
+        ''', {'bucket': bucket, 'capacity': capacity, 'rate': rate, 'cost': cost})
+        tokens, admitted = cur.fetchone()
+    conn.commit()
+
+    with _lock:
+        _local[bucket] = (tokens, time.monotonic())
+        _local.move_to_end(bucket)
+        if len(_local) > LOCAL_BUCKETS:
+            _local.popitem(last=False)
+    return 0.0 if admitted else _retry_after(tokens, rate, cost)
+
+
+def too_many_requests(retry_after: float) -> Dict:
+    return error_response(429, 'Too many requests', {'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+def prune_buckets(conn, idle: str = '1 hour') -> int:
+    '''Drop buckets untouched for longer than idle; a full bucket carries no state worth keeping'''
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM rate_limit_buckets WHERE updated_at < NOW() - INTERVAL '{idle}'")
+        pruned = cur.rowcount
+    conn.commit()
+    return pruned
@@ -0,0 +1,120 @@
+'''
+Stateless HMAC-signed session tokens with an in-process verification cache.
+Vendored into every backend/<function>/ next to db.py; keep the copies identical.
+'''
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from db import getconn, putconn
+
+TOKEN_SECRET = os.environ.get('TOKEN_SECRET', '')
+TOKEN_TTL = int(os.environ.get('TOKEN_TTL', str(7 * 24 * 3600)))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '1024'))
+REVOCATION_REFRESH = float(os.environ.get('TOKEN_REVOCATION_REFRESH', '30'))
+
+_verified: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+_revoked: set = set()
+_revoked_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(TOKEN_SECRET.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user_id: int, role: str, name: str) -> str:
+    if not TOKEN_SECRET:
+        raise RuntimeError('TOKEN_SECRET is not configured')
+    claims = {
+        'uid': user_id,
+        'role': role,
+        'name': name,
+        'exp': int(time.time()) + TOKEN_TTL,
+        'jti': secrets.token_urlsafe(12)
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f'{payload}.{_sign(payload)}'
+
+
+def verify_token(token: str) -> Optional[Dict[str, Any]]:
+    '''Return the token claims, or None if the token is malformed, forged, expired or revoked'''
+    if not token or not TOKEN_SECRET:
+        return None
+    _refresh_revocations()
+
+    with _lock:
+        claims = _verified.get(token)
+        if claims is not None:
+            _verified.move_to_end(token)
+
+    if claims is None:
+        payload, _, signature = token.partition('.')
+        if not signature or not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+        with _lock:
+            _verified[token] = claims
+            if len(_verified) > TOKEN_CACHE_SIZE:
+                _verified.popitem(last=False)
+
+    if claims['exp'] <= time.time() or claims['jti'] in _revoked:
+        return None
+    return claims
+
+
+def authenticate(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    headers = event.get('headers') or {}
+    value = headers.get('authorization', headers.get('Authorization', ''))
+    if value.startswith('Bearer '):
+        value = value[len('Bearer '):]
+    else:
+        value = headers.get('x-auth-token', headers.get('X-Auth-Token', ''))
+    return verify_token(value.strip())
+
+
+def revoke_token(conn, claims: Dict[str, Any]) -> None:
+    with conn.cursor() as cur:
+        cur.execute('''
+            INSERT INTO revoked_tokens (jti, expires_at)
+            VALUES (%s, TO_TIMESTAMP(%s))
+            ON CONFLICT (jti) DO NOTHING
+        ''', (claims['jti'], claims['exp']))
+    conn.commit()
+    _revoked.add(claims['jti'])
+
+
+def _refresh_revocations() -> None:
+    global _revoked, _revoked_loaded_at
+    if time.monotonic() - _revoked_loaded_at < REVOCATION_REFRESH:
+        return
+    _revoked_loaded_at = time.monotonic()
+
+    try:
+        conn = getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT jti FROM revoked_tokens WHERE expires_at > NOW()')
+                _revoked = {row[0] for row in cur.fetchall()}
+        finally:
+            putconn(conn)
+    except Exception as e:
+        print(json.dumps({'token_revocations': 'refresh failed', 'error': str(e)}))
@@ -0,0 +1,322 @@
+'''
+Self-hosted HTTP gateway for the backend functions.
+
+Mounts every backend/<function>/index.py handler under /<function>. Each
+HTTP request becomes the event dict the hosted platform would pass, and
+the blocking handler runs on a sized thread pool. Long-polls (any request
+with a non-zero wait parameter: chat wait=, voice action=drain&wait=) hold
+their thread and DB connection for up to 25 s, so they run on a separate
+--long-poll-threads pool and cannot starve the other routes; requests past
+that limit queue for a free long-poll thread. Supports HTTP/1.1
+keep-alive and graceful shutdown on SIGTERM/SIGINT. --workers N forks N
+processes that share the listening port through SO_REUSEPORT; each has
+its own event loop, thread pool and DB pools.
+
+    DATABASE_URL=postgresql://localhost/lrl TOKEN_SECRET=... \
+        python backend/gateway.py --port 8000 --workers 4 --threads 16 --long-poll-threads 32
+
+Each worker's DB pool defaults to threads + long-poll-threads connections,
+so size max_connections for workers * (threads + long-poll-threads).
+
+With --maintenance-interval the first worker also runs the chat and voice
+maintenance entry points on a timer, standing in for the platform's
+scheduled triggers.
+'''
+import argparse
+import asyncio
+import base64
+import importlib.util
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS = ['auth', 'chat', 'members', 'schedule', 'voice', 'sync']
+MAINTENANCE_FUNCTIONS = ['chat', 'voice']
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = int(os.environ.get('GATEWAY_MAX_BODY_BYTES', str(8 * 1024 * 1024)))
+KEEP_ALIVE_TIMEOUT = float(os.environ.get('GATEWAY_KEEP_ALIVE_TIMEOUT', '15'))
+SHUTDOWN_GRACE = float(os.environ.get('GATEWAY_SHUTDOWN_GRACE', '30'))
+
+
+def load_modules(functions: List[str] = FUNCTIONS) -> Dict[str, Any]:
+    '''
+    Import each function's index.py under a unique module name. The vendored
+    modules next to it (db, response, ...) are identical copies, so whichever
+    directory Python resolves them from first serves all functions.
+    '''
+    modules = {}
+    for name in functions:
+        directory = os.path.join(BACKEND, name)
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(directory, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        modules[name] = module
+    return modules
+
+
+def load_handlers(functions: List[str] = FUNCTIONS) -> Dict[str, Callable]:
+    return {name: module.handler for name, module in load_modules(functions).items()}
+
+
+def build_event(method: str, target: str, headers: Dict[str, str], body: bytes,
+                peer: Optional[Tuple]) -> Tuple[str, Dict[str, Any]]:
+    url = urlsplit(target)
+    parts = url.path.strip('/').split('/', 1)
+    function = parts[0]
+    try:
+        text, encoded = body.decode(), False
+    except UnicodeDecodeError:
+        text, encoded = base64.b64encode(body).decode(), True
+    event = {
+        'httpMethod': method,
+        'path': '/' + (parts[1] if len(parts) > 1 else ''),
+        # Header names are case-insensitive; handlers look them up lowercased
+        'headers': {name.lower(): value for name, value in headers.items()},
+        'queryStringParameters': dict(parse_qsl(url.query, keep_blank_values=True)),
+        'body': text,
+        'isBase64Encoded': encoded,
+        'requestContext': {
+            'requestId': str(uuid.uuid4()),
+            'identity': {'sourceIp': peer[0] if peer else ''},
+        },
+    }
+    return function, event
+
+
+def encode_response(response: Dict[str, Any], keep_alive: bool) -> bytes:
+    status = int(response.get('statusCode', 200))
+    body = response.get('body') or ''
+    payload = base64.b64decode(body) if response.get('isBase64Encoded') else body.encode()
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ''
+    lines = [f'HTTP/1.1 {status} {reason}']
+    for name, value in (response.get('headers') or {}).items():
+        if name.lower() not in ('content-length', 'connection', 'transfer-encoding'):
+            lines.append(f'{name}: {value}')
+    lines.append(f'Content-Length: {len(payload)}')
+    lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', 'replace') + payload
+
+
+def error(status: int, message: str) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': message})
+    }
+
+
+class Gateway:
+    def __init__(self, handlers: Dict[str, Callable], threads: int, long_poll_threads: int):
+        self.handlers = handlers
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='handler')
+        self.long_poll_executor = ThreadPoolExecutor(max_workers=long_poll_threads, thread_name_prefix='long-poll')
+        self.in_flight = 0
+        self.connections: set = set()
+        self.idle: set = set()
+        self.closing = False
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self.connections.add(task)
+        peer = writer.get_extra_info('peername')
+        try:
+            while not self.closing:
+                self.idle.add(task)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(encode_response(error(431, 'Request headers too large'), False))
+                    break
+                finally:
+                    self.idle.discard(task)
+
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ', 2)
+                except ValueError:
+                    writer.write(encode_response(error(400, 'Malformed request line'), False))
+                    break
+                headers: Dict[str, str] = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, _, value = line.partition(':')
+                        headers[name.strip()] = value.strip()
+                lowered = {name.lower(): value for name, value in headers.items()}
+
+                if 'chunked' in lowered.get('transfer-encoding', '').lower():
+                    writer.write(encode_response(error(411, 'Chunked request bodies are not supported'), False))
+                    break
+                try:
+                    length = int(lowered.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    writer.write(encode_response(error(400, 'Invalid Content-Length'), False))
+                    break
+                if length > MAX_BODY_BYTES:
+                    writer.write(encode_response(error(413, 'Request body too large'), False))
+                    break
+                try:
+                    body = await asyncio.wait_for(reader.readexactly(length), KEEP_ALIVE_TIMEOUT) if length else b''
+                except asyncio.TimeoutError:
+                    writer.write(encode_response(error(408, 'Request body timed out'), False))
+                    break
+
+                connection = lowered.get('connection', '').lower()
+                keep_alive = (connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive')
+                response = await self.dispatch(method, target, headers, body, peer)
+                writer.write(encode_response(response, keep_alive and not self.closing))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(task)
+            self.idle.discard(task)
+            writer.close()
+
+    async def dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes,
+                       peer: Optional[Tuple]) -> Dict[str, Any]:
+        function, event = build_event(method, target, headers, body, peer)
+        handler = self.handlers.get(function)
+        if handler is None:
+            return error(404, f'No function mounted at /{function}')
+
+        context = SimpleNamespace(request_id=event['requestContext']['requestId'], function_name=function)
+        long_poll = event['queryStringParameters'].get('wait', '0') not in ('', '0')
+        executor = self.long_poll_executor if long_poll else self.executor
+        self.in_flight += 1
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(executor, handler, event, context)
+        except Exception as e:
+            print(json.dumps({'gateway': 'handler failed', 'function': function, 'error': repr(e)}))
+            response = error(500, 'Internal server error')
+        finally:
+            self.in_flight -= 1
+        return response
+
+    async def drain(self, grace: float) -> None:
+        '''
+        Close idle keep-alive connections at once; busy ones finish their
+        current request (sent with Connection: close) within the grace period.
+        '''
+        self.closing = True
+        for task in list(self.idle):
+            task.cancel()
+        deadline = time.monotonic() + grace
+        while self.connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in list(self.connections):
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.long_poll_executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_maintenance(interval: float) -> None:
+    modules = load_modules(MAINTENANCE_FUNCTIONS)
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        for name, module in modules.items():
+            try:
+                await loop.run_in_executor(None, module.maintenance, {'source': 'gateway'}, None)
+            except Exception as e:
+                print(json.dumps({'gateway': 'maintenance failed', 'function': name, 'error': repr(e)}))
+
+
+async def serve(sock: socket.socket, threads: int, long_poll_threads: int, maintenance_interval: float) -> None:
+    gateway = Gateway(load_handlers(), threads, long_poll_threads)
+    server = await asyncio.start_server(gateway.serve_connection, sock=sock, limit=MAX_HEADER_BYTES)
+    maintenance = asyncio.create_task(run_maintenance(maintenance_interval)) if maintenance_interval else None
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    print(json.dumps({'gateway': 'listening', 'pid': os.getpid(), 'address': sock.getsockname()[:2]}))
+    await stop.wait()
+
+    server.close()
+    if maintenance:
+        maintenance.cancel()
+    await gateway.drain(SHUTDOWN_GRACE)
+    await server.wait_closed()
+    print(json.dumps({'gateway': 'stopped', 'pid': os.getpid()}))
+
+
+def bind(host: str, port: int, reuse_port: bool) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Serve the backend functions over HTTP')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1, help='worker processes sharing the port')
+    parser.add_argument('--threads', type=int, default=16, help='handler threads per worker')
+    parser.add_argument('--long-poll-threads', type=int, default=16,
+                        help='threads per worker reserved for long-polls (requests with wait > 0)')
+    parser.add_argument('--maintenance-interval', type=float, default=0,
+                        help='seconds between chat/voice maintenance runs in the first worker (0 disables)')
+    args = parser.parse_args()
+
+    # One DB connection per handler thread, so held long-polls never take the other routes' connections
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.threads + args.long_poll_threads))
+
+    if args.workers <= 1:
+        asyncio.run(serve(bind(args.host, args.port, False), args.threads, args.long_poll_threads,
+                          args.maintenance_interval))
+        return
+
+    children = []
+    for index in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            sock = bind(args.host, args.port, True)
+            asyncio.run(serve(sock, args.threads, args.long_poll_threads,
+                              args.maintenance_interval if index == 0 else 0))
+            os._exit(0)
+        children.append(pid)
+
+    def forward(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for child in children:
+        os.waitpid(child, 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,63 +1,44 @@
-import json
-import os
 from typing import Dict, Any
-import psycopg2
 
+from db import getconn, putconn, warmup
+from instrument import instrumented
+from response import error_response, json_response, preflight
+from members_queries import MAX_PAGE_SIZE, fetch_members
+
+warmup()
+
+@instrumented('members')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Get regiment members list
-    Args: event with httpMethod
-    Returns: HTTP response with members list
+    Business: Get regiment members list with live presence, filtered by role/status and keyset-paginated
+    Args: event with httpMethod, queryStringParameters (role, status, after, limit), If-None-Match header
+    Returns: HTTP response with members list, or 304 when the roster page is unchanged
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'isBase64Encoded': False,
-            'body': ''
-        }
+        return preflight('GET, OPTIONS', 'Content-Type, If-None-Match, X-Primary-Until')
     
     if method != 'GET':
-        return {
-            'statusCode': 405,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
+        return error_response(405, 'Method not allowed')
     
-    cur.execute('SELECT id, name, role, status, avatar FROM t_p55033217_lrl_messenger_game_p.members ORDER BY id')
-    rows = cur.fetchall()
+    # Deliberately public: a read-only roster with presence, so no token is checked
     
-    members = []
-    for row in rows:
-        members.append({
-            'id': row[0],
-            'name': row[1],
-            'role': row[2],
-            'status': row[3],
-            'avatar': row[4]
-        })
+    params = event.get('queryStringParameters') or {}
     
-    cur.close()
+    try:
+        after = int(params.get('after', 0))
+        limit = max(0, min(int(params.get('limit', 0)), MAX_PAGE_SIZE))
+    except ValueError:
+        return error_response(400, 'after and limit must be integers')
     
-    conn.close()
+    conn = getconn(read_only=True, event=event)
+    try:
+        members = fetch_members(conn, params.get('role'), params.get('status'), after, limit)
+    finally:
+        putconn(conn)
     
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'isBase64Encoded': False,
-        'body': json.dumps({'members': members})
-    }
\ No newline at end of file
+    return json_response(event, 200, {
+        'members': members,
+        'next_after': members[-1]['id'] if limit and len(members) == limit else None
+    }, cache='revalidate')
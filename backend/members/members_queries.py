@@ -0,0 +1,47 @@
+'''
+Read queries for the regiment roster, shared by the members and sync functions.
+Vendored into backend/members/ and backend/sync/; keep the copies identical.
+'''
+from typing import Any, Dict, List, Optional
+
+VOICE_PRESENCE_TIMEOUT = '45 seconds'
+CHAT_ACTIVITY_WINDOW = '5 minutes'
+MAX_PAGE_SIZE = 500
+
+def fetch_members(conn, role: Optional[str] = None, status: Optional[str] = None,
+                  after: int = 0, limit: int = 0) -> List[Dict[str, Any]]:
+    '''
+    Roster derived from users; a member is online while they hold a live voice
+    heartbeat or have posted in chat recently. Keyset-paginated by user id.
+    '''
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT id, name, role, status, avatar FROM (
+                SELECT u.id, u.display_name AS name, u.role, u.avatar,
+                       CASE WHEN u.last_active_at >= NOW() - INTERVAL '{CHAT_ACTIVITY_WINDOW}'
+                                 OR EXISTS (
+                                     SELECT 1 FROM voice_connections vc
+                                     WHERE vc.user_id = u.id AND vc.disconnected_at IS NULL
+                                     AND vc.last_seen_at >= NOW() - INTERVAL '{VOICE_PRESENCE_TIMEOUT}'
+                                 )
+                            THEN 'online' ELSE 'offline' END AS status
+                FROM users u
+                WHERE u.id > %(after)s
+                AND (%(role)s::text IS NULL OR u.role = %(role)s)
+            ) roster
+            WHERE %(status)s::text IS NULL OR status = %(status)s
+            ORDER BY id
+            LIMIT %(limit)s
+        ''', {'after': after, 'role': role, 'status': status, 'limit': limit or None})
+        rows = cur.fetchall()
+    
+    members = []
+    for row in rows:
+        members.append({
+            'id': row[0],
+            'name': row[1],
+            'role': row[2],
+            'status': row[3],
+            'avatar': row[4]
+        })
+    return members
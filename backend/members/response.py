@@ -0,0 +1,174 @@
+'''
+Response helpers shared by every function: JSON encoding, gzip, ETags,
+cache policies and CORS headers.
+Vendored into every backend/<function>/ next to db.py; keep the copies identical.
+'''
+import base64
+import gzip
+import hashlib
+import io
+import json
+from typing import Any, Dict, Iterable, Optional
+
+from db import primary_until_header
+from instrument import phase
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+
+CACHE_POLICIES = {
+    'no-store': 'no-store',
+    'revalidate': 'no-cache',
+    'short': 'public, max-age=60',
+    'static': 'public, max-age=300, stale-while-revalidate=86400',
+}
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Expose-Headers': 'ETag, Server-Timing, Retry-After, X-Primary-Until',
+    'Timing-Allow-Origin': '*',
+}
+
+
+def _default(value: Any) -> str:
+    '''What orjson does for datetimes, plus str() for the rest, so both encoders agree'''
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def dumps(payload: Any) -> str:
+    with phase('serialize'):
+        if orjson is not None:
+            return orjson.dumps(payload, default=_default).decode()
+        return json.dumps(payload, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def strong_etag(body: str) -> str:
+    return '"' + hashlib.sha1(body.encode()).hexdigest()[:20] + '"'
+
+
+def request_header(event: Dict[str, Any], name: str) -> str:
+    headers = event.get('headers') or {}
+    return headers.get(name.lower(), headers.get(name, ''))
+
+
+def preflight(methods: str, allow_headers: str = 'Content-Type') -> Dict[str, Any]:
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': allow_headers,
+            'Access-Control-Max-Age': '86400'
+        },
+        'isBase64Encoded': False,
+        'body': ''
+    }
+
+
+def not_modified(etag: str, cache: Optional[str] = None) -> Dict[str, Any]:
+    headers = {'ETag': etag, **CORS_HEADERS}
+    if cache:
+        headers['Cache-Control'] = CACHE_POLICIES[cache]
+    return {
+        'statusCode': 304,
+        'headers': headers,
+        'isBase64Encoded': False,
+        'body': ''
+    }
+
+
+def respond(event: Dict[str, Any], status: int, body: str, content_type: str = 'application/json',
+            cache: Optional[str] = None, etag: Optional[str] = None,
+            headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''
+    Build a platform response. GET 200s get a strong ETag (computed from the
+    body unless given) and answer 304 on If-None-Match; bodies above
+    GZIP_MIN_BYTES are gzipped when the client accepts it. Successful writes
+    carry X-Primary-Until for read-your-writes routing.
+    '''
+    if status == 200 and event.get('httpMethod', 'GET') == 'GET':
+        etag = etag or strong_etag(body)
+        if request_header(event, 'If-None-Match') == etag:
+            return not_modified(etag, cache)
+
+    response_headers = {'Content-Type': content_type, **CORS_HEADERS}
+    if status < 400 and event.get('httpMethod', 'GET') not in ('GET', 'HEAD', 'OPTIONS'):
+        response_headers.update(primary_until_header())
+    if etag:
+        response_headers['ETag'] = etag
+    if cache:
+        response_headers['Cache-Control'] = CACHE_POLICIES[cache]
+    if headers:
+        response_headers.update(headers)
+
+    encoded = body.encode()
+    if len(encoded) >= GZIP_MIN_BYTES:
+        response_headers['Vary'] = 'Accept-Encoding'
+        if 'gzip' in request_header(event, 'Accept-Encoding'):
+            response_headers['Content-Encoding'] = 'gzip'
+            with phase('serialize'):
+                compressed = base64.b64encode(gzip.compress(encoded, GZIP_LEVEL)).decode()
+            return {
+                'statusCode': status,
+                'headers': response_headers,
+                'isBase64Encoded': True,
+                'body': compressed
+            }
+
+    return {
+        'statusCode': status,
+        'headers': response_headers,
+        'isBase64Encoded': False,
+        'body': body
+    }
+
+
+def stream_response(event: Dict[str, Any], status: int, chunks: Iterable[bytes], content_type: str,
+                    headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''
+    Assemble a body from encoded chunks without materializing rows: with gzip
+    accepted each chunk is compressed as it arrives, so only the compressed
+    body is held in memory. Never cached, no ETag.
+    '''
+    response_headers = {'Content-Type': content_type, 'Cache-Control': CACHE_POLICIES['no-store'],
+                        'Vary': 'Accept-Encoding', **CORS_HEADERS, **(headers or {})}
+    if 'gzip' not in request_header(event, 'Accept-Encoding'):
+        return {
+            'statusCode': status,
+            'headers': response_headers,
+            'isBase64Encoded': False,
+            'body': b''.join(chunks).decode()
+        }
+    
+    compressed = io.BytesIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=GZIP_LEVEL) as archive:
+        for chunk in chunks:
+            archive.write(chunk)
+    response_headers['Content-Encoding'] = 'gzip'
+    with phase('serialize'):
+        body = base64.b64encode(compressed.getvalue()).decode()
+    return {
+        'statusCode': status,
+        'headers': response_headers,
+        'isBase64Encoded': True,
+        'body': body
+    }
+
+
+def json_response(event: Dict[str, Any], status: int, payload: Any, cache: Optional[str] = None,
+                  etag: Optional[str] = None, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return respond(event, status, dumps(payload), 'application/json', cache, etag, headers)
+
+
+def error_response(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', **CORS_HEADERS, **(headers or {})},
+        'isBase64Encoded': False,
+        'body': json.dumps({'error': message})
+    }
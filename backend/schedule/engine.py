@@ -0,0 +1,201 @@
+'''
+Weekly recurrence engine for the regiment schedule.
+
+Rows store the weekday as a Russian name ('Вторник') and the start time as
+'HH:MM' text. They are parsed into typed weekly recurrences in SCHEDULE_TZ
+and expanded into a sorted occurrence index covering SCHEDULE_WEEKS weeks,
+so next/range queries are a bisect over an in-memory list.
+'''
+import bisect
+import hashlib
+import json
+import os
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+SCHEDULE_TZ = ZoneInfo(os.environ.get('SCHEDULE_TZ', 'Europe/Moscow'))
+SCHEDULE_WEEKS = int(os.environ.get('SCHEDULE_WEEKS', '4'))
+
+WEEKDAYS = {
+    'Понедельник': 0,
+    'Вторник': 1,
+    'Среда': 2,
+    'Четверг': 3,
+    'Пятница': 4,
+    'Суббота': 5,
+    'Воскресенье': 6,
+}
+ICS_WEEKDAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+ICS_LINE_OCTETS = 75
+
+
+class Recurrence(NamedTuple):
+    id: int
+    title: str
+    description: str
+    weekday: int
+    start: time
+
+
+class Occurrence(NamedTuple):
+    starts_at: datetime
+    recurrence: Recurrence
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.recurrence.id,
+            'title': self.recurrence.title,
+            'description': self.recurrence.description,
+            'starts_at': self.starts_at.isoformat(),
+        }
+
+
+def parse_rows(rows: List[Tuple]) -> List[Recurrence]:
+    recurrences = []
+    for row_id, title, start, date, description in rows:
+        weekday = WEEKDAYS.get(date.strip())
+        try:
+            hours, minutes = start.strip().split(':')
+            start_time = time(int(hours), int(minutes))
+        except ValueError:
+            start_time = None
+        if weekday is None or start_time is None:
+            print(json.dumps({'schedule': 'unparseable row skipped', 'id': row_id}))
+            continue
+        recurrences.append(Recurrence(row_id, title, description or '', weekday, start_time))
+    return recurrences
+
+
+class ScheduleIndex:
+    def __init__(self, rows: List[Tuple], now: Optional[datetime] = None):
+        self.rows = rows
+        self.version = hashlib.sha1(json.dumps(rows, default=str).encode()).hexdigest()[:16]
+        self.recurrences = parse_rows(rows)
+        self.built_at = now or datetime.now(timezone.utc)
+        self.occurrences = self._expand(self.built_at)
+        self._starts = [occurrence.starts_at for occurrence in self.occurrences]
+
+    def _expand(self, now: datetime) -> List[Occurrence]:
+        local_today = now.astimezone(SCHEDULE_TZ).date()
+        week_start = local_today - timedelta(days=local_today.weekday())
+        occurrences = []
+        for week in range(SCHEDULE_WEEKS + 1):
+            for recurrence in self.recurrences:
+                day = week_start + timedelta(weeks=week, days=recurrence.weekday)
+                starts_at = datetime.combine(day, recurrence.start, tzinfo=SCHEDULE_TZ)
+                occurrences.append(Occurrence(starts_at, recurrence))
+        occurrences.sort(key=lambda occurrence: (occurrence.starts_at, occurrence.recurrence.id))
+        return occurrences
+
+    def is_stale(self, now: datetime) -> bool:
+        return now - self.built_at >= timedelta(days=1)
+
+    def next(self, now: datetime, limit: int) -> List[Occurrence]:
+        position = bisect.bisect_left(self._starts, now)
+        return self.occurrences[position:position + limit]
+
+    def range(self, start: datetime, end: datetime) -> List[Occurrence]:
+        return self.occurrences[bisect.bisect_left(self._starts, start):bisect.bisect_left(self._starts, end)]
+
+    def to_ics(self) -> str:
+        lines = [
+            'BEGIN:VCALENDAR',
+            'VERSION:2.0',
+            'PRODID:-//LRL Regiment//Schedule//RU',
+            'CALSCALE:GREGORIAN',
+        ]
+        lines += _vtimezone(self.built_at)
+        stamp = self.built_at.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        first_seen = {}
+        for occurrence in self.occurrences:
+            first_seen.setdefault(occurrence.recurrence.id, occurrence)
+        for occurrence in first_seen.values():
+            recurrence = occurrence.recurrence
+            lines += [
+                'BEGIN:VEVENT',
+                f'UID:schedule-{recurrence.id}@lrl-regiment',
+                f'DTSTAMP:{stamp}',
+                f'DTSTART;TZID={SCHEDULE_TZ.key}:{occurrence.starts_at.strftime("%Y%m%dT%H%M%S")}',
+                f'RRULE:FREQ=WEEKLY;BYDAY={ICS_WEEKDAYS[recurrence.weekday]}',
+                f'SUMMARY:{_ics_escape(recurrence.title)}',
+                f'DESCRIPTION:{_ics_escape(recurrence.description)}',
+                'END:VEVENT',
+            ]
+        lines.append('END:VCALENDAR')
+        return ''.join(_ics_fold(line) + '\r\n' for line in lines)
+
+
+def _utc_offset(moment: datetime) -> timedelta:
+    return moment.astimezone(SCHEDULE_TZ).utcoffset()
+
+
+def _ics_offset(offset: timedelta) -> str:
+    minutes = int(offset.total_seconds()) // 60
+    return f'{"+" if minutes >= 0 else "-"}{abs(minutes) // 60:02d}{abs(minutes) % 60:02d}'
+
+
+def _observance(onset: datetime, before: timedelta) -> List[str]:
+    '''One VTIMEZONE observance starting at onset (UTC); DTSTART is local time under the previous offset'''
+    local = onset.astimezone(SCHEDULE_TZ)
+    kind = 'DAYLIGHT' if local.dst() else 'STANDARD'
+    return [
+        f'BEGIN:{kind}',
+        f'DTSTART:{(onset + before).strftime("%Y%m%dT%H%M%S")}',
+        f'TZOFFSETFROM:{_ics_offset(before)}',
+        f'TZOFFSETTO:{_ics_offset(local.utcoffset())}',
+        f'TZNAME:{local.tzname()}',
+        f'END:{kind}',
+    ]
+
+
+def _vtimezone(now: datetime, years: int = 2) -> List[str]:
+    '''
+    VTIMEZONE for SCHEDULE_TZ, which DTSTART;TZID= requires. Offset changes
+    within the next years are listed as dated observances; a zone without
+    any (Europe/Moscow) gets a single STANDARD observance.
+    '''
+    start = now.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    local = start.astimezone(SCHEDULE_TZ)
+    kind = 'DAYLIGHT' if local.dst() else 'STANDARD'
+    lines = [
+        'BEGIN:VTIMEZONE',
+        f'TZID:{SCHEDULE_TZ.key}',
+        f'BEGIN:{kind}',
+        'DTSTART:19700101T000000',
+        f'TZOFFSETFROM:{_ics_offset(local.utcoffset())}',
+        f'TZOFFSETTO:{_ics_offset(local.utcoffset())}',
+        f'TZNAME:{local.tzname()}',
+        f'END:{kind}',
+    ]
+    previous = local.utcoffset()
+    for day in range(1, years * 366 + 1):
+        if _utc_offset(start + timedelta(days=day)) == previous:
+            continue
+        # Narrow the change down to the quarter hour within that day
+        onset = start + timedelta(days=day - 1)
+        while _utc_offset(onset) == previous:
+            onset += timedelta(minutes=15)
+        lines += _observance(onset, previous)
+        previous = _utc_offset(onset)
+    lines.append('END:VTIMEZONE')
+    return lines
+
+
+def _ics_fold(line: str) -> str:
+    '''Fold to ICS_LINE_OCTETS octets per line (RFC 5545 3.1) without splitting a UTF-8 character'''
+    parts = []
+    current, size, limit = '', 0, ICS_LINE_OCTETS
+    for char in line:
+        octets = len(char.encode())
+        if size + octets > limit:
+            parts.append(current)
+            current, size, limit = '', 0, ICS_LINE_OCTETS - 1
+        current += char
+        size += octets
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+
+def _ics_escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
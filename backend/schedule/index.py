@@ -1,61 +1,96 @@
-import json
-import os
-from typing import Dict, Any
-import psycopg2
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional
 
+from db import getconn, putconn, warmup
+from engine import SCHEDULE_TZ, ScheduleIndex
+from instrument import instrumented
+from response import dumps, error_response, preflight, respond
+
+warmup()
+
+SCHEDULE_CACHE_TTL = 300
+MAX_OCCURRENCES = 200
+
+_index: Optional[ScheduleIndex] = None
+_loaded_at = 0.0
+
+def load_index(now: datetime) -> ScheduleIndex:
+    global _index, _loaded_at
+    if _index is not None and time.monotonic() - _loaded_at < SCHEDULE_CACHE_TTL and not _index.is_stale(now):
+        return _index
+    
+    conn = getconn(read_only=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT id, title, time, date, description FROM schedule ORDER BY id')
+            rows = [tuple(row) for row in cur.fetchall()]
+    finally:
+        putconn(conn)
+    
+    if _index is None or _index.rows != rows or _index.is_stale(now):
+        _index = ScheduleIndex(rows, now)
+    _loaded_at = time.monotonic()
+    return _index
+
+def parse_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=SCHEDULE_TZ)
+
+@instrumented('schedule')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Get regiment schedule
-    Args: event with httpMethod
-    Returns: HTTP response with schedule
+    Business: Get regiment schedule - raw list, next occurrences, a time range or an ICS feed
+    Args: event with httpMethod, queryStringParameters (view=list|next|range, limit, from, to, format=ics)
+    Returns: HTTP response with schedule, cacheable via Cache-Control and ETag
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return preflight('GET, OPTIONS', 'Content-Type, If-None-Match')
     
     if method != 'GET':
-        return {
-            'statusCode': 405,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
-    
-    cur.execute('SELECT id, title, time, date, description FROM schedule ORDER BY id')
-    rows = cur.fetchall()
-    
-    events = []
-    for row in rows:
-        events.append({
-            'id': row[0],
-            'title': row[1],
-            'time': row[2],
-            'date': row[3],
-            'description': row[4]
-        })
-    
-    cur.close()
-    conn.close()
-    
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'isBase64Encoded': False,
-        'body': json.dumps({'schedule': events})
-    }
\ No newline at end of file
+        return error_response(405, 'Method not allowed')
+    
+    # Deliberately public: read-only, and calendar apps subscribe to the ICS feed without a token
+    
+    params = event.get('queryStringParameters') or {}
+    view = params.get('view', 'list')
+    
+    try:
+        now = datetime.now(timezone.utc)
+        index = load_index(now)
+        
+        if params.get('format') == 'ics':
+            content_type = 'text/calendar; charset=utf-8'
+            cache = 'static'
+            body = index.to_ics()
+        elif view == 'next':
+            limit = max(1, min(int(params.get('limit', 5)), MAX_OCCURRENCES))
+            content_type = 'application/json'
+            cache = 'short'
+            body = dumps({'upcoming': [o.as_dict() for o in index.next(now, limit)], 'version': index.version})
+        elif view == 'range':
+            start = parse_time(params['from']) if params.get('from') else now
+            end = parse_time(params['to']) if params.get('to') else start + timedelta(weeks=1)
+            content_type = 'application/json'
+            cache = 'short'
+            occurrences = index.range(start, end)[:MAX_OCCURRENCES]
+            body = dumps({'occurrences': [o.as_dict() for o in occurrences], 'version': index.version})
+        else:
+            events = []
+            for row in index.rows:
+                events.append({
+                    'id': row[0],
+                    'title': row[1],
+                    'time': row[2],
+                    'date': row[3],
+                    'description': row[4]
+                })
+            content_type = 'application/json'
+            cache = 'static'
+            body = dumps({'schedule': events, 'version': index.version})
+    except (KeyError, ValueError):
+        return error_response(400, 'limit must be an integer, from/to must be ISO 8601 timestamps')
+    
+    return respond(event, 200, body, content_type, cache=cache)
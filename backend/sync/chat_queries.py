@@ -0,0 +1,167 @@
+'''
+Read queries for chat history, shared by the chat and sync functions.
+Vendored into backend/chat/ and backend/sync/; keep the copies identical.
+'''
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+from db import execute_prepared, prepare
+
+MAX_PAGE_SIZE = 500
+MAX_SEARCH_PAGE_SIZE = 100
+
+MESSAGE_COLUMNS = '''
+    id, author, avatar, content, role,
+    TO_CHAR(created_at, 'HH24:MI') as timestamp
+'''
+
+# Delta cursors are id watermarks, but ids are taken from a sequence at
+# INSERT and become visible at COMMIT. Two writers could commit out of id
+# order, and a poller that had moved past the higher id would never see the
+# lower one. Writers to messages and message_deletions therefore take a
+# per-table transaction advisory lock before drawing an id. Ids then commit
+# in order, so MAX(id) is always a safe watermark.
+DELTA_WRITE_LOCKS = {'messages': 7301, 'message_deletions': 7302}
+
+def lock_delta_writes(cur, table: str) -> None:
+    '''Serialize id allocation through commit for a delta-polled table; call before the INSERT'''
+    cur.execute('SELECT pg_advisory_xact_lock(%s)', (DELTA_WRITE_LOCKS[table],))
+
+# Run by every poll, conditional or not
+prepare('chat_state', '''
+    SELECT COALESCE((SELECT MAX(id) FROM messages), 0),
+           COALESCE((SELECT MAX(id) FROM message_deletions), 0)
+''')
+
+def fetch_chat_state(conn) -> Tuple[int, int]:
+    with conn.cursor() as cur:
+        execute_prepared(cur, 'chat_state')
+        return cur.fetchone()
+
+def chat_etag(state: Tuple[int, int]) -> str:
+    return f'"{state[0]}.{state[1]}"'
+
+def fetch_chat_page(conn, state: Tuple[int, int], since_id: Optional[int] = None,
+                    before: Optional[int] = None, deleted_since: int = 0, limit: int = 0) -> Dict[str, Any]:
+    '''
+    Delta after since_id (plus deletions after deleted_since), a page before
+    the before cursor, the latest limit messages, or the full history.
+    '''
+    last_message_id, last_deletion_id = state
+    deleted = []
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        if since_id is not None:
+            cur.execute(f'''
+                SELECT {MESSAGE_COLUMNS}
+                FROM messages
+                WHERE id > %s AND deleted_at IS NULL
+                ORDER BY id ASC
+                LIMIT %s
+            ''', (since_id, limit or None))
+            messages = cur.fetchall()
+            
+            cur.execute('''
+                SELECT message_id
+                FROM message_deletions
+                WHERE id > %s AND id <= %s AND message_id <= %s
+                ORDER BY id ASC
+            ''', (deleted_since, last_deletion_id, since_id))
+            deleted = [row['message_id'] for row in cur.fetchall()]
+        elif before is not None or limit:
+            cur.execute(f'''
+                SELECT * FROM (
+                    SELECT {MESSAGE_COLUMNS}
+                    FROM messages
+                    WHERE id < %s AND deleted_at IS NULL
+                    ORDER BY id DESC
+                    LIMIT %s
+                ) page
+                ORDER BY id ASC
+            ''', (before if before is not None else last_message_id + 1, limit or None))
+            messages = cur.fetchall()
+        else:
+            cur.execute(f'''
+                SELECT {MESSAGE_COLUMNS}
+                FROM messages
+                WHERE deleted_at IS NULL
+                ORDER BY id ASC
+            ''')
+            messages = cur.fetchall()
+    
+    if messages and before is None:
+        next_since_id = messages[-1]['id']
+    else:
+        next_since_id = since_id if since_id is not None else last_message_id
+    
+    return {
+        'messages': messages,
+        'deleted': deleted,
+        'cursor': {
+            'since_id': next_since_id,
+            'deleted_since': last_deletion_id,
+            'before': messages[0]['id'] if messages else before
+        },
+        'has_more': bool(limit) and len(messages) == limit
+    }
+
+def search_messages(conn, query: str, author: Optional[str] = None, role: Optional[str] = None,
+                    since: Optional[datetime] = None, until: Optional[datetime] = None,
+                    before: Optional[int] = None, limit: int = 20) -> Dict[str, Any]:
+    '''
+    Newest-first full-text matches over the GIN-indexed search_vector, keyset
+    paginated by id. Snippets are HTML-escaped with matches wrapped in <mark>.
+    '''
+    conditions = ['search_vector @@ q.query', 'deleted_at IS NULL']
+    values = [query, query]
+    if author:
+        conditions.append('author = %s')
+        values.append(author)
+    if role:
+        conditions.append('role = %s')
+        values.append(role)
+    if since:
+        conditions.append('created_at >= %s')
+        values.append(since)
+    if until:
+        conditions.append('created_at < %s')
+        values.append(until)
+    if before is not None:
+        conditions.append('id < %s')
+        values.append(before)
+    values.append(limit + 1)
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            WITH q AS (
+                SELECT websearch_to_tsquery('russian', %s) || websearch_to_tsquery('simple', %s) AS query
+            ), page AS (
+                SELECT id, author, avatar, content, role, created_at
+                FROM messages, q
+                WHERE {' AND '.join(conditions)}
+                ORDER BY id DESC
+                LIMIT %s
+            )
+            SELECT page.id, author, avatar, role,
+                   TO_CHAR(created_at, 'HH24:MI') as timestamp,
+                   created_at,
+                   ts_headline(
+                       'russian',
+                       REPLACE(REPLACE(REPLACE(content, '&', '&amp;'), '<', '&lt;'), '>', '&gt;'),
+                       q.query,
+                       'StartSel=<mark>, StopSel=</mark>, MaxWords=30, MinWords=10, MaxFragments=2'
+                   ) AS snippet
+            FROM page, q
+            ORDER BY page.id DESC
+        ''', values)
+        results = cur.fetchall()
+    
+    has_more = len(results) > limit
+    results = results[:limit]
+    return {
+        'results': results,
+        'cursor': {'before': results[-1]['id'] if results else before},
+        'has_more': has_more
+    }
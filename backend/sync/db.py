@@ -0,0 +1,383 @@
+'''
+Process-wide Postgres connection pools shared by warm invocations of a function.
+Writes go to DATABASE_URL. When DATABASE_URL_READ is set, read-only paths go
+to a replica pool, unless the replica lags by more than DB_REPLICA_MAX_LAG or
+the client sent X-Primary-Until after a recent write of its own.
+warmup(), called at import by every index.py, resolves the DSN host once
+and opens the first connection before the first request arrives. Statements
+registered with prepare() are PREPAREd on every new connection.
+Each function directory is deployed on its own, so this module is vendored
+into every backend/<function>/ and the copies must stay identical.
+'''
+import json
+import os
+import re
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+from instrument import TracedConnection, phase
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '5'))
+POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '600'))
+POOL_HEALTHCHECK_IDLE = float(os.environ.get('DB_POOL_HEALTHCHECK_IDLE', '30'))
+POOL_METRICS_INTERVAL = float(os.environ.get('DB_POOL_METRICS_INTERVAL', '60'))
+REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '2'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_LAG_CHECK_INTERVAL', '5'))
+READ_YOUR_WRITES_WINDOW = float(os.environ.get('DB_READ_YOUR_WRITES_WINDOW', '5'))
+PRIMARY_UNTIL_HEADER = 'X-Primary-Until'
+WARMUP_CONNECT = os.environ.get('DB_WARMUP_CONNECT', '1') == '1'
+PREPARE_STATEMENTS = os.environ.get('DB_PREPARE_STATEMENTS', '1') == '1'
+DNS_TTL = float(os.environ.get('DB_DNS_TTL', '60'))
+# libpq connect failures where the address itself did not answer
+NETWORK_ERROR = re.compile(r'Connection refused|No route to host|Network is unreachable|'
+                           r'timeout expired|timed out|Connection reset|server closed the connection unexpectedly')
+
+PREPARED: Dict[str, Tuple[str, str]] = {}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, dsn: str, max_size: int = POOL_MAX_SIZE, wait_timeout: float = POOL_WAIT_TIMEOUT,
+                 max_age: float = POOL_MAX_AGE, healthcheck_idle: float = POOL_HEALTHCHECK_IDLE,
+                 role: str = 'primary'):
+        self.dsn = dsn
+        self.role = role
+        self.connect_kwargs = resolve_host(dsn)
+        self._resolved_at = time.monotonic()
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.max_age = max_age
+        self.healthcheck_idle = healthcheck_idle
+        self._idle: List[Any] = []
+        self._born: Dict[int, float] = {}
+        self._returned: Dict[int, float] = {}
+        self._size = 0
+        self._cond = threading.Condition()
+        self._metrics_logged_at = time.monotonic()
+        self.stats = {
+            'connections_created': 0,
+            'connections_recycled': 0,
+            'checkouts': 0,
+            'checkout_waits': 0,
+            'checkout_timeouts': 0,
+            'healthcheck_failures': 0,
+            'failed_transactions': 0,
+            'checkout_ms_total': 0.0,
+            'checkout_ms_max': 0.0,
+        }
+
+    def getconn(self):
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['checkout_timeouts'] += 1
+                    raise PoolTimeout(f'No database connection available within {self.wait_timeout}s')
+                self.stats['checkout_waits'] += 1
+                self._cond.wait(remaining)
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._size += 1
+
+        if conn is not None and not self._is_usable(conn):
+            self._close(conn)
+            conn = None
+        if conn is None:
+            conn = self._connect()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._cond:
+            self.stats['checkouts'] += 1
+            self.stats['checkout_ms_total'] += elapsed_ms
+            self.stats['checkout_ms_max'] = max(self.stats['checkout_ms_max'], elapsed_ms)
+        return conn
+
+    def putconn(self, conn) -> None:
+        keep = not conn.closed and time.monotonic() - self._born.get(id(conn), 0) < self.max_age
+        if keep:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+                self.stats['failed_transactions'] += 1
+                keep = False
+            elif status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                keep = False
+            else:
+                try:
+                    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    if getattr(conn, 'listening', False):
+                        with conn.cursor() as cur:
+                            cur.execute('UNLISTEN *')
+                        conn.notifies.clear()
+                        conn.listening = False
+                    if conn.autocommit:
+                        conn.autocommit = False
+                except psycopg2.Error:
+                    keep = False
+
+        if not keep:
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+        else:
+            self._returned[id(conn)] = time.monotonic()
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+        self._maybe_log_metrics()
+
+    def owns(self, conn) -> bool:
+        return id(conn) in self._born
+    
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            snapshot = dict(self.stats)
+            snapshot['size'] = self._size
+            snapshot['idle'] = len(self._idle)
+            snapshot['in_use'] = self._size - len(self._idle)
+            snapshot['max_size'] = self.max_size
+        checkouts = snapshot['checkouts'] or 1
+        snapshot['checkout_ms_avg'] = round(snapshot.pop('checkout_ms_total') / checkouts, 3)
+        snapshot['checkout_ms_max'] = round(snapshot['checkout_ms_max'], 3)
+        return snapshot
+
+    def _open(self):
+        '''
+        Connect through the cached host address, re-resolved every DB_DNS_TTL
+        seconds. A failed connect drops the cached address; only a network
+        failure (refused, unreachable, timed out, as after a failover moved
+        DNS) is retried by hostname straight away. A server that answered and
+        refused (bad password, too many clients) is not asked twice.
+        '''
+        if time.monotonic() - self._resolved_at >= DNS_TTL:
+            self.connect_kwargs = resolve_host(self.dsn)
+            self._resolved_at = time.monotonic()
+        kwargs = self.connect_kwargs
+        if not kwargs:
+            return psycopg2.connect(self.dsn, connection_factory=TracedConnection)
+        try:
+            return psycopg2.connect(self.dsn, connection_factory=TracedConnection, **kwargs)
+        except psycopg2.OperationalError as e:
+            self._resolved_at = float('-inf')
+            if not NETWORK_ERROR.search(str(e)):
+                raise
+            return psycopg2.connect(self.dsn, connection_factory=TracedConnection)
+
+    def _connect(self):
+        conn = None
+        try:
+            conn = self._open()
+            conn.prepared = _prepare_all(conn)
+        except Exception:
+            if conn is not None:
+                conn.close()
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self._born[id(conn)] = time.monotonic()
+        self.stats['connections_created'] += 1
+        return conn
+
+    def _is_usable(self, conn) -> bool:
+        if conn.closed or time.monotonic() - self._born.get(id(conn), 0) >= self.max_age:
+            return False
+        if time.monotonic() - self._returned.get(id(conn), 0) < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            self.stats['healthcheck_failures'] += 1
+            return False
+
+    def _close(self, conn) -> None:
+        self.stats['connections_recycled'] += 1
+        self._born.pop(id(conn), None)
+        self._returned.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _maybe_log_metrics(self) -> None:
+        now = time.monotonic()
+        if now - self._metrics_logged_at < POOL_METRICS_INTERVAL:
+            return
+        self._metrics_logged_at = now
+        print(json.dumps({'db_pool': self.metrics(), 'dsn_role': self.role}))
+
+
+def resolve_host(dsn: Optional[str]) -> Dict[str, str]:
+    '''Resolve the DSN host once so new connections skip DNS (libpq hostaddr)'''
+    try:
+        params = psycopg2.extensions.parse_dsn(dsn or '')
+        host = params.get('host', '')
+        if not host or host.startswith('/') or ',' in host or 'hostaddr' in params:
+            return {}
+        info = socket.getaddrinfo(host, params.get('port', 5432), type=socket.SOCK_STREAM)
+        return {'hostaddr': info[0][4][0]}
+    except (psycopg2.Error, OSError, ValueError):
+        return {}
+
+
+def prepare(name: str, statement: str) -> None:
+    '''Register a statement (%s placeholders) to be PREPAREd on every new connection'''
+    placeholders = iter(range(1, statement.count('%s') + 1))
+    PREPARED[name] = (statement, re.sub('%s', lambda _: f'${next(placeholders)}', statement))
+
+
+def _prepare_all(conn) -> set:
+    if not PREPARE_STATEMENTS or not PREPARED:
+        return set()
+    with conn.cursor() as cur:
+        for name, (_, server_statement) in PREPARED.items():
+            cur.execute(f'PREPARE {name} AS {server_statement}')
+    conn.commit()
+    return set(PREPARED)
+
+
+def execute_prepared(cur, name: str, params: Sequence[Any] = ()) -> None:
+    '''EXECUTE a prepared statement, or run its text on connections that lack it'''
+    if name in getattr(cur.connection, 'prepared', ()):
+        arguments = f' ({", ".join(["%s"] * len(params))})' if params else ''
+        cur.execute(f'EXECUTE {name}{arguments}', params)
+    else:
+        cur.execute(PREPARED[name][0], params)
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pool_lock = threading.Lock()
+_replica = {'lag': 0.0, 'checked_at': float('-inf')}
+
+
+def get_pool(role: str = 'primary') -> ConnectionPool:
+    pool = _pools.get(role)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(role)
+            if pool is None:
+                dsn = os.environ.get('DATABASE_URL_READ' if role == 'replica' else 'DATABASE_URL')
+                pool = _pools[role] = ConnectionPool(dsn, role=role)
+    return pool
+
+
+def primary_until_header() -> Dict[str, str]:
+    '''Header a write response returns; clients echo it so their next reads see the write'''
+    return {PRIMARY_UNTIL_HEADER: str(int((time.time() + READ_YOUR_WRITES_WINDOW) * 1000))}
+
+
+def _wants_primary(event: Optional[Dict[str, Any]]) -> bool:
+    headers = (event or {}).get('headers') or {}
+    value = headers.get(PRIMARY_UNTIL_HEADER.lower(), headers.get(PRIMARY_UNTIL_HEADER, ''))
+    try:
+        return float(value) / 1000 > time.time()
+    except ValueError:
+        return False
+
+
+def _measure_lag(conn) -> float:
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+            END
+        ''')
+        lag = float(cur.fetchone()[0])
+    conn.rollback()
+    return lag
+
+
+def _replica_conn():
+    '''A replica connection, or None when the replica is lagging or unreachable'''
+    stale = time.monotonic() - _replica['checked_at'] >= REPLICA_LAG_CHECK_INTERVAL
+    if not stale and _replica['lag'] > REPLICA_MAX_LAG:
+        return None
+    
+    pool = get_pool('replica')
+    try:
+        conn = pool.getconn()
+    except (PoolTimeout, psycopg2.Error):
+        _replica.update(lag=float('inf'), checked_at=time.monotonic())
+        return None
+    if stale:
+        try:
+            lag = _measure_lag(conn)
+        except psycopg2.Error:
+            lag = float('inf')
+        if lag > REPLICA_MAX_LAG and _replica['lag'] <= REPLICA_MAX_LAG:
+            print(json.dumps({'db_replica': 'lagging, reading from primary', 'lag_s': lag}))
+        _replica.update(lag=lag, checked_at=time.monotonic())
+        if lag > REPLICA_MAX_LAG:
+            pool.putconn(conn)
+            return None
+    return conn
+
+
+def getconn(read_only: bool = False, event: Optional[Dict[str, Any]] = None):
+    '''
+    Borrow a connection. read_only callers are routed to the replica when one
+    is configured, healthy and the event carries no fresh X-Primary-Until.
+    '''
+    with phase('connect'):
+        if read_only and os.environ.get('DATABASE_URL_READ') and not _wants_primary(event):
+            conn = _replica_conn()
+            if conn is not None:
+                return conn
+        return get_pool().getconn()
+
+
+def listen(conn, channel: str) -> None:
+    '''LISTEN on an autocommit connection; putconn runs UNLISTEN * however the request ended'''
+    with conn.cursor() as cur:
+        cur.execute(f'LISTEN {channel}')
+    conn.listening = True
+
+
+def warmup() -> Dict[str, float]:
+    '''
+    Run at import: build the pools and open their first connection while the
+    platform is still initializing the instance, so the first request reuses it.
+    '''
+    timings = {}
+    roles = ['primary'] + (['replica'] if os.environ.get('DATABASE_URL_READ') else [])
+    for role in roles:
+        started = time.perf_counter()
+        pool = get_pool(role)
+        timings[f'{role}_resolve_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        if not WARMUP_CONNECT or not pool.dsn:
+            continue
+        started = time.perf_counter()
+        try:
+            pool.putconn(pool.getconn())
+        except Exception as e:
+            print(json.dumps({'db_warmup': 'connect failed', 'role': role, 'error': str(e)}))
+            continue
+        timings[f'{role}_connect_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    if os.environ.get('DATABASE_URL'):
+        print(json.dumps({'db_warmup': timings, 'prepared': sorted(PREPARED)}))
+    return timings
+
+
+def putconn(conn) -> None:
+    for pool in list(_pools.values()):
+        if pool.owns(conn):
+            pool.putconn(conn)
+            return
+    conn.close()
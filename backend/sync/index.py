@@ -0,0 +1,74 @@
+import hashlib
+import json
+from typing import Dict, Any
+
+from chat_queries import MAX_PAGE_SIZE, fetch_chat_page, fetch_chat_state
+from db import getconn, putconn, warmup
+from instrument import instrumented
+from members_queries import fetch_members
+from response import error_response, json_response, preflight
+from voice_queries import fetch_channels, fetch_peers
+
+warmup()
+
+def section_version(data: Any) -> str:
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+@instrumented('sync')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Aggregate poll - chat delta, voice occupancy, members and voice peers in one snapshot
+    Args: event with httpMethod, queryStringParameters holding per-section cursors and versions
+    Returns: HTTP response with only the sections that changed since the client's cursors
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return preflight('GET, OPTIONS', 'Content-Type, If-None-Match, X-Primary-Until')
+    
+    if method != 'GET':
+        return error_response(405, 'Method not allowed')
+    
+    # Deliberately public: every section is a read that chat, voice and members already serve without a token
+    
+    params = event.get('queryStringParameters') or {}
+    sections = set(params.get('sections', 'chat,voice,members,peers').split(','))
+    channel_id = params.get('channel_id')
+    
+    try:
+        chat_since_id = params.get('chat_since_id')
+        chat_since_id = int(chat_since_id) if chat_since_id is not None else None
+        chat_deleted_since = int(params.get('chat_deleted_since', 0))
+        chat_limit = max(0, min(int(params.get('chat_limit', 0)), MAX_PAGE_SIZE))
+        channel_id = int(channel_id) if channel_id is not None else None
+    except ValueError:
+        return error_response(400, 'chat cursors, chat_limit and channel_id must be integers')
+    
+    result: Dict[str, Any] = {}
+    
+    conn = getconn(read_only=True, event=event)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        
+        if 'chat' in sections:
+            state = fetch_chat_state(conn)
+            if chat_since_id is None or chat_since_id < state[0] or chat_deleted_since < state[1]:
+                result['chat'] = fetch_chat_page(conn, state, chat_since_id, None, chat_deleted_since, chat_limit)
+        
+        versioned = []
+        if 'voice' in sections:
+            versioned.append(('voice', 'channels', fetch_channels(conn)))
+        if 'members' in sections:
+            versioned.append(('members', 'members', fetch_members(conn)))
+        if 'peers' in sections and channel_id is not None:
+            versioned.append(('peers', 'peers', fetch_peers(conn, channel_id)))
+    finally:
+        putconn(conn)
+    
+    for section, key, data in versioned:
+        version = section_version(data)
+        if params.get(f'{section}_version') != version:
+            result[section] = {key: data, 'version': version}
+    
+    return json_response(event, 200, result, cache='revalidate')
@@ -1,184 +1,324 @@
 import json
-import os
-import psycopg2
-from typing import Dict, Any
-from datetime import datetime
+import select
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Any, List
 
+from db import getconn, listen, putconn, warmup
+from instrument import instrumented, phase
+from ratelimit import check_local, consume, prune_buckets, too_many_requests
+from response import error_response, json_response, preflight
+from tokens import authenticate
+from usage import MAX_STATS_DAYS, compact_sessions, fetch_usage_stats
+from voice_queries import PRESENCE_TIMEOUT, fetch_channels, fetch_peers
+
+warmup()
+
+HEARTBEAT_INTERVAL = 15
+HEARTBEAT_COALESCE = 10
+HEARTBEAT_CACHE_SIZE = 4096
+SIGNAL_TTL = '60 seconds'
+SIGNAL_NOTIFY_CHANNEL = 'voice_signals'
+LONG_POLL_MAX_WAIT = 25.0
+RATE_LIMITED_ACTIONS = {'join': 'voice.join', 'signal': 'voice.signal'}
+MAX_SIGNALS_PER_REQUEST = 32
+MAX_SIGNAL_BYTES = 16384
+
+_heartbeats: Dict[str, float] = {}
+
+def remember_heartbeat(user_id: int, peer_id: str) -> None:
+    if len(_heartbeats) >= HEARTBEAT_CACHE_SIZE:
+        _heartbeats.clear()
+    _heartbeats[f'{user_id}:{peer_id}'] = time.monotonic()
+
+def owns_peer(cur, user_id: int, peer_id: str) -> bool:
+    '''Whether peer_id is an open connection joined under this user's token'''
+    cur.execute('''
+        SELECT 1 FROM voice_connections
+        WHERE peer_id = %s AND user_id = %s AND disconnected_at IS NULL
+        LIMIT 1
+    ''', (peer_id, user_id))
+    return cur.fetchone() is not None
+
+def parse_signals(body_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    '''The signals a signal request queues, either a signals list or a single to_peer/signal pair; ValueError if malformed'''
+    outgoing = body_data.get('signals') or [{
+        'to_peer': body_data.get('to_peer'),
+        'signal': body_data.get('signal')
+    }]
+    if not isinstance(outgoing, list) or not all(isinstance(item, dict) for item in outgoing):
+        raise ValueError('signals must be a list of objects')
+    if len(outgoing) > MAX_SIGNALS_PER_REQUEST:
+        raise ValueError(f'At most {MAX_SIGNALS_PER_REQUEST} signals per request')
+    if not body_data.get('from_peer') or not all(item.get('to_peer') and item.get('signal') is not None for item in outgoing):
+        raise ValueError('from_peer, to_peer and signal required')
+    for item in outgoing:
+        item['payload'] = json.dumps(item['signal'])
+        if len(item['payload']) > MAX_SIGNAL_BYTES:
+            raise ValueError(f'Signal payload over {MAX_SIGNAL_BYTES} bytes')
+    return outgoing
+
+def wait_for_notify(conn, timeout: float) -> List[str]:
+    '''Block until NOTIFYs arrive on a LISTENing connection or the timeout passes'''
+    with phase('wait'):
+        ready = select.select([conn], [], [], timeout)
+    if ready == ([], [], []):
+        return []
+    conn.poll()
+    payloads = [notify.payload for notify in conn.notifies]
+    conn.notifies.clear()
+    return payloads
+
+def drain_signals(cur, peer_id: str) -> List[Dict[str, Any]]:
+    cur.execute(f'''
+        DELETE FROM voice_signals
+        WHERE to_peer = %s AND created_at >= NOW() - INTERVAL '{SIGNAL_TTL}'
+        RETURNING id, from_peer, payload
+    ''', (peer_id,))
+    rows = sorted(cur.fetchall())
+    return [{'from_peer': row[1], 'signal': json.loads(row[2])} for row in rows]
+
+def maintenance(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Periodic voice maintenance - close connections whose heartbeat expired, prune expired signals and idle rate-limit buckets, compact closed sessions into usage rollups
+    Args: event from the scheduled trigger
+    Returns: HTTP response with the number of swept connections and pruned signals
+    '''
+    conn = getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                UPDATE voice_connections 
+                SET disconnected_at = NOW() 
+                WHERE disconnected_at IS NULL 
+                AND last_seen_at < NOW() - INTERVAL '{PRESENCE_TIMEOUT}'
+            ''')
+            swept = cur.rowcount
+            
+            cur.execute(f"DELETE FROM voice_signals WHERE created_at < NOW() - INTERVAL '{SIGNAL_TTL}'")
+            pruned_signals = cur.rowcount
+        conn.commit()
+        pruned_buckets = prune_buckets(conn)
+        compacted = compact_sessions(conn)
+    finally:
+        putconn(conn)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'isBase64Encoded': False,
+        'body': json.dumps({'swept': swept, 'pruned_signals': pruned_signals, 'pruned_buckets': pruned_buckets,
+                           'compacted_sessions': compacted})
+    }
+
+@instrumented('voice')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: WebRTC signaling server for voice chat
+    Business: WebRTC signaling server for voice chat, plus usage stats from daily rollups
     Args: event with httpMethod, body, queryStringParameters
     Returns: Manages voice channel connections and WebRTC signaling
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Session-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return preflight('GET, POST, PUT, DELETE, OPTIONS', 'Content-Type, Authorization, If-None-Match, X-Primary-Until')
+    
+    body_data = json.loads(event.get('body') or '{}') if method == 'POST' else {}
+    if method == 'POST':
+        action = body_data.get('action')
+    else:
+        action = (event.get('queryStringParameters') or {}).get('action', 'list')
+    
+    # Peer ids are public through action=peers, so everything that acts as a peer needs the token it joined with
+    claims = None
+    if method == 'POST' or action == 'drain':
+        claims = authenticate(event)
+        if not claims:
+            return error_response(401, 'Valid token required')
+    
+    # Every queued signal costs a token, so batching cannot outrun the bucket
+    rate_cost = 1
+    if method == 'POST' and action == 'signal':
+        try:
+            outgoing = parse_signals(body_data)
+        except ValueError as e:
+            return error_response(400, str(e))
+        rate_cost = len(outgoing)
+    
+    rate_route = RATE_LIMITED_ACTIONS.get(action) if method == 'POST' else None
+    if rate_route:
+        # Always the verified user: peer ids are client-chosen and free to rotate
+        rate_key = str(claims['uid'])
+        retry_after = check_local(rate_route, rate_key, rate_cost)
+        if retry_after:
+            return too_many_requests(retry_after)
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    # drain deletes and LISTENs, so only list, peers and stats can read from a replica
+    conn = getconn(method == 'GET' and action in ('list', 'peers', 'stats'), event)
     cur = conn.cursor()
     
     try:
         if method == 'GET':
-            action = event.get('queryStringParameters', {}).get('action', 'list')
             
             if action == 'list':
-                cur.execute('''
-                    UPDATE voice_connections 
-                    SET disconnected_at = NOW() 
-                    WHERE disconnected_at IS NULL 
-                    AND connected_at < NOW() - INTERVAL '5 minutes'
-                ''')
-                conn.commit()
+                result_channels = fetch_channels(conn)
                 
-                cur.execute('SELECT id, name FROM voice_channels ORDER BY id')
-                channels = cur.fetchall()
+                return json_response(event, 200, {'channels': result_channels}, cache='revalidate')
+            
+            elif action == 'drain':
+                params = event.get('queryStringParameters', {})
+                peer_id = params.get('peer_id')
+                if not peer_id:
+                    return error_response(400, 'peer_id required')
                 
-                result_channels = []
-                for channel in channels:
-                    cur.execute(f"SELECT COUNT(*) FROM voice_connections WHERE channel_id = {channel[0]} AND disconnected_at IS NULL")
-                    user_count = cur.fetchone()[0]
-                    
-                    result_channels.append({
-                        'id': channel[0],
-                        'name': channel[1],
-                        'users': user_count
-                    })
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'channels': result_channels})
-                }
+                try:
+                    wait = max(0.0, min(float(params.get('wait', 0)), LONG_POLL_MAX_WAIT))
+                except ValueError:
+                    return error_response(400, 'wait must be a number')
+                
+                conn.autocommit = True
+                if not owns_peer(cur, claims['uid'], peer_id):
+                    return error_response(403, 'peer_id is not joined under this token')
+                
+                if wait:
+                    listen(conn, SIGNAL_NOTIFY_CHANNEL)
+                
+                deadline = time.monotonic() + wait
+                signals = drain_signals(cur, peer_id)
+                while not signals and wait:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    payloads = wait_for_notify(conn, remaining)
+                    if peer_id in payloads:
+                        signals = drain_signals(cur, peer_id)
+                
+                return json_response(event, 200, {'signals': signals}, cache='no-store')
+            
+            elif action == 'stats':
+                params = event.get('queryStringParameters') or {}
+                today = datetime.now(timezone.utc).date()
+                try:
+                    since = date.fromisoformat(params['from']) if params.get('from') else today - timedelta(days=30)
+                    until = date.fromisoformat(params['to']) if params.get('to') else today + timedelta(days=1)
+                    channel_id = int(params['channel_id']) if params.get('channel_id') else None
+                    user_id = int(params['user_id']) if params.get('user_id') else None
+                except ValueError:
+                    return error_response(400, 'from and to must be YYYY-MM-DD, channel_id and user_id integers')
+                if not since < until or (until - since).days > MAX_STATS_DAYS:
+                    return error_response(400, f'from must precede to by at most {MAX_STATS_DAYS} days')
+                
+                stats = fetch_usage_stats(conn, since, until, channel_id, user_id)
+                
+                return json_response(event, 200, stats, cache='short')
             
             elif action == 'peers':
                 channel_id = event.get('queryStringParameters', {}).get('channel_id')
                 if not channel_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'channel_id required'})
-                    }
-                
-                cur.execute(f'''
-                    SELECT vc.peer_id, u.display_name, u.avatar 
-                    FROM voice_connections vc
-                    JOIN users u ON vc.user_id = u.id
-                    WHERE vc.channel_id = {channel_id} AND vc.disconnected_at IS NULL
-                ''')
-                peers = cur.fetchall()
-                
-                result_peers = [{'peer_id': p[0], 'name': p[1], 'avatar': p[2]} for p in peers]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'peers': result_peers})
-                }
+                    return error_response(400, 'channel_id required')
+                
+                result_peers = fetch_peers(conn, channel_id)
+                
+                return json_response(event, 200, {'peers': result_peers}, cache='revalidate')
         
         elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
+            if rate_route:
+                retry_after = consume(conn, rate_route, rate_key, rate_cost)
+                if retry_after:
+                    return too_many_requests(retry_after)
             
             if action == 'join':
                 channel_id = body_data.get('channel_id')
-                user_id = body_data.get('user_id')
+                user_id = claims['uid']
                 peer_id = body_data.get('peer_id')
                 
-                if not all([channel_id, user_id, peer_id]):
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'channel_id, user_id, peer_id required'})
-                    }
-                
-                cur.execute(f'''
-                    INSERT INTO voice_connections (channel_id, user_id, peer_id, connected_at)
-                    VALUES ({channel_id}, {user_id}, '{peer_id}', NOW())
-                ''')
+                if not all([channel_id, peer_id]):
+                    return error_response(400, 'channel_id, peer_id required')
+                
+                cur.execute('''
+                    SELECT 1 FROM voice_connections
+                    WHERE peer_id = %s AND user_id <> %s AND disconnected_at IS NULL
+                    LIMIT 1
+                ''', (peer_id, user_id))
+                if cur.fetchone():
+                    conn.rollback()
+                    return error_response(409, 'peer_id is in use by another user')
+                
+                cur.execute('''
+                    INSERT INTO voice_connections (channel_id, user_id, peer_id, connected_at, last_seen_at)
+                    VALUES (%s, %s, %s, NOW(), NOW())
+                ''', (channel_id, user_id, peer_id))
                 conn.commit()
+                remember_heartbeat(user_id, peer_id)
+                
+                return json_response(event, 200, {'success': True, 'heartbeat_interval': HEARTBEAT_INTERVAL}, cache='no-store')
+            
+            elif action == 'heartbeat':
+                peer_id = body_data.get('peer_id')
+                
+                if not peer_id:
+                    return error_response(400, 'peer_id required')
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'success': True})
-                }
+                user_id = claims['uid']
+                last_beat = _heartbeats.get(f'{user_id}:{peer_id}')
+                if last_beat is None or time.monotonic() - last_beat >= HEARTBEAT_COALESCE:
+                    cur.execute(f'''
+                        WITH active AS (
+                            SELECT id, last_seen_at FROM voice_connections
+                            WHERE peer_id = %s AND user_id = %s AND disconnected_at IS NULL
+                        ), touched AS (
+                            UPDATE voice_connections vc
+                            SET last_seen_at = NOW()
+                            FROM active
+                            WHERE vc.id = active.id
+                            AND active.last_seen_at < NOW() - INTERVAL '{HEARTBEAT_COALESCE} seconds'
+                            RETURNING vc.id
+                        )
+                        SELECT (SELECT COUNT(*) FROM active), (SELECT COUNT(*) FROM touched)
+                    ''', (peer_id, user_id))
+                    active_count, touched_count = cur.fetchone()
+                    conn.commit()
+                    
+                    if not active_count:
+                        _heartbeats.pop(f'{user_id}:{peer_id}', None)
+                        return error_response(404, 'Peer is not connected')
+                    remember_heartbeat(user_id, peer_id)
+                
+                return json_response(event, 200, {'success': True, 'heartbeat_interval': HEARTBEAT_INTERVAL}, cache='no-store')
             
             elif action == 'leave':
                 peer_id = body_data.get('peer_id')
                 
                 if not peer_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'peer_id required'})
-                    }
+                    return error_response(400, 'peer_id required')
                 
-                cur.execute(f'''
+                cur.execute('''
                     UPDATE voice_connections 
                     SET disconnected_at = NOW() 
-                    WHERE peer_id = '{peer_id}' AND disconnected_at IS NULL
-                ''')
+                    WHERE peer_id = %s AND user_id = %s AND disconnected_at IS NULL
+                ''', (peer_id, claims['uid']))
                 conn.commit()
+                _heartbeats.pop(f"{claims['uid']}:{peer_id}", None)
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'success': True})
-                }
+                return json_response(event, 200, {'success': True}, cache='no-store')
             
             elif action == 'signal':
                 from_peer = body_data.get('from_peer')
-                to_peer = body_data.get('to_peer')
-                signal = body_data.get('signal')
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({
-                        'success': True,
-                        'from_peer': from_peer,
-                        'to_peer': to_peer,
-                        'signal': signal
-                    })
-                }
+                if not owns_peer(cur, claims['uid'], from_peer):
+                    conn.rollback()
+                    return error_response(403, 'from_peer is not joined under this token')
+                
+                rows = [(item['to_peer'], from_peer, item['payload']) for item in outgoing]
+                from psycopg2.extras import execute_values
+                execute_values(cur, 'INSERT INTO voice_signals (to_peer, from_peer, payload) VALUES %s', rows)
+                for to_peer in {item['to_peer'] for item in outgoing}:
+                    cur.execute('SELECT pg_notify(%s, %s)', (SIGNAL_NOTIFY_CHANNEL, to_peer))
+                conn.commit()
+                
+                return json_response(event, 200, {'success': True, 'queued': len(rows)}, cache='no-store')
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return error_response(405, 'Method not allowed')
     
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        putconn(conn)
\ No newline at end of file
@@ -0,0 +1,172 @@
+'''
+Compaction of closed voice sessions into daily usage rollups, and the
+stats queries answered from them.
+
+Closed rows are deleted from voice_connections COMPACT_BATCH_SIZE at a time.
+Each batch's minutes and session counts are added to voice_usage_daily in
+the same statement, so a session is never counted twice or lost. A session
+counts towards the day it started. Swept sessions end PRESENCE_TIMEOUT after
+their last heartbeat rather than at sweep time.
+
+Peak concurrency for the days a batch touches is computed over every
+session still in voice_connections on those channels, open or closed,
+compacted in this batch or not, and merged with GREATEST. A session that
+overlapped one compacted earlier was still in the table when the earlier
+one was compacted, so each overlap is counted by at least one run.
+'''
+import os
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from voice_queries import PRESENCE_TIMEOUT
+
+COMPACT_BATCH_SIZE = int(os.environ.get('VOICE_COMPACT_BATCH_SIZE', '5000'))
+COMPACT_TIME_BUDGET = float(os.environ.get('VOICE_COMPACT_TIME_BUDGET', '20'))
+COMPACT_MIN_AGE = '1 hour'
+MAX_STATS_DAYS = 366
+
+
+def compact_batch(conn) -> int:
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            WITH batch AS (
+                DELETE FROM voice_connections
+                WHERE id IN (
+                    SELECT id FROM voice_connections
+                    WHERE disconnected_at IS NOT NULL
+                    AND disconnected_at < NOW() - INTERVAL '{COMPACT_MIN_AGE}'
+                    ORDER BY id
+                    LIMIT %s
+                )
+                RETURNING channel_id, user_id, connected_at,
+                          GREATEST(connected_at, LEAST(disconnected_at,
+                              COALESCE(last_seen_at, disconnected_at) + INTERVAL '{PRESENCE_TIMEOUT}')) AS ended_at
+            ), usage AS (
+                INSERT INTO voice_usage_daily AS u (day, channel_id, user_id, sessions, seconds)
+                SELECT connected_at::date, channel_id, user_id, COUNT(*),
+                       SUM(EXTRACT(EPOCH FROM ended_at - connected_at))
+                FROM batch
+                GROUP BY 1, 2, 3
+                ON CONFLICT (day, channel_id, user_id) DO UPDATE
+                SET sessions = u.sessions + EXCLUDED.sessions, seconds = u.seconds + EXCLUDED.seconds
+            ), span AS (
+                SELECT MIN(connected_at)::date AS first_day, MAX(ended_at)::date + 1 AS end_day,
+                       ARRAY_AGG(DISTINCT channel_id) AS channels
+                FROM batch
+            ), overlapping AS (
+                -- Same snapshot as the DELETE, so the batch's own rows are still visible here
+                SELECT vc.channel_id, vc.connected_at,
+                       GREATEST(vc.connected_at, LEAST(COALESCE(vc.disconnected_at, NOW()),
+                           COALESCE(vc.last_seen_at, vc.disconnected_at, NOW()) + INTERVAL '{PRESENCE_TIMEOUT}')) AS ended_at
+                FROM voice_connections vc, span
+                WHERE vc.channel_id = ANY(span.channels)
+                AND vc.connected_at < span.end_day
+                AND COALESCE(vc.disconnected_at, NOW()) >= span.first_day
+            ), edges AS (
+                SELECT channel_id, connected_at AS at, 1 AS delta FROM overlapping
+                UNION ALL
+                SELECT channel_id, ended_at, -1 FROM overlapping
+            ), running AS (
+                SELECT channel_id, at::date AS day,
+                       SUM(delta) OVER (PARTITION BY channel_id ORDER BY at, delta) AS concurrent
+                FROM edges
+            ), peaks AS (
+                INSERT INTO voice_channel_peaks AS p (day, channel_id, peak_concurrency)
+                SELECT day, channel_id, MAX(concurrent)
+                FROM running, span
+                WHERE concurrent > 0 AND day >= span.first_day AND day < span.end_day
+                GROUP BY day, channel_id
+                ON CONFLICT (day, channel_id) DO UPDATE
+                SET peak_concurrency = GREATEST(p.peak_concurrency, EXCLUDED.peak_concurrency)
+            )
+            SELECT COUNT(*) FROM batch
+        ''', (COMPACT_BATCH_SIZE,))
+        compacted = cur.fetchone()[0]
+    conn.commit()
+    return compacted
+
+
+def compact_sessions(conn) -> int:
+    '''Compact batches until the backlog is gone or COMPACT_TIME_BUDGET runs out'''
+    compacted = 0
+    deadline = time.monotonic() + COMPACT_TIME_BUDGET
+    while time.monotonic() < deadline:
+        batch = compact_batch(conn)
+        compacted += batch
+        if batch < COMPACT_BATCH_SIZE:
+            break
+    return compacted
+
+
+def fetch_usage_stats(conn, since: date, until: date, channel_id: Optional[int] = None,
+                      user_id: Optional[int] = None) -> Dict[str, Any]:
+    '''Per-channel totals, a daily series and the top users for [since, until)'''
+    from psycopg2.extras import RealDictCursor
+    
+    conditions = ['day >= %s', 'day < %s']
+    values: List[Any] = [since, until]
+    if channel_id is not None:
+        conditions.append('channel_id = %s')
+        values.append(channel_id)
+    if user_id is not None:
+        conditions.append('user_id = %s')
+        values.append(user_id)
+    where = ' AND '.join(conditions)
+    peak_where = ' AND '.join(condition for condition in conditions if not condition.startswith('user_id'))
+    peak_values = values[:3] if channel_id is not None else values[:2]
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            SELECT u.channel_id, ch.name,
+                   SUM(u.sessions) AS sessions,
+                   ROUND((SUM(u.seconds) / 60)::numeric, 1)::float8 AS minutes,
+                   COUNT(DISTINCT u.user_id) AS users,
+                   (SELECT MAX(peak_concurrency) FROM voice_channel_peaks p
+                    WHERE p.channel_id = u.channel_id AND p.day >= %s AND p.day < %s) AS peak_concurrency
+            FROM voice_usage_daily u
+            JOIN voice_channels ch ON ch.id = u.channel_id
+            WHERE {where}
+            GROUP BY u.channel_id, ch.name
+            ORDER BY u.channel_id
+        ''', [since, until] + values)
+        channels = cur.fetchall()
+        
+        cur.execute(f'''
+            SELECT TO_CHAR(d.day, 'YYYY-MM-DD') AS day, d.sessions, d.minutes, COALESCE(pk.peak, 0) AS peak_concurrency
+            FROM (
+                SELECT day, SUM(sessions) AS sessions, ROUND((SUM(seconds) / 60)::numeric, 1)::float8 AS minutes
+                FROM voice_usage_daily
+                WHERE {where}
+                GROUP BY day
+            ) d
+            LEFT JOIN (
+                SELECT day, MAX(peak_concurrency) AS peak
+                FROM voice_channel_peaks
+                WHERE {peak_where}
+                GROUP BY day
+            ) pk ON pk.day = d.day
+            ORDER BY d.day
+        ''', values + peak_values)
+        days = cur.fetchall()
+        
+        cur.execute(f'''
+            SELECT u.user_id, usr.display_name,
+                   SUM(u.sessions) AS sessions,
+                   ROUND((SUM(u.seconds) / 60)::numeric, 1)::float8 AS minutes
+            FROM voice_usage_daily u
+            LEFT JOIN users usr ON usr.id = u.user_id
+            WHERE {where}
+            GROUP BY u.user_id, usr.display_name
+            ORDER BY minutes DESC
+            LIMIT 10
+        ''', values)
+        top_users = cur.fetchall()
+    
+    return {
+        'from': since.isoformat(),
+        'to': until.isoformat(),
+        'channels': channels,
+        'days': days,
+        'top_users': top_users
+    }
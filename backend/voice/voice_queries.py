@@ -0,0 +1,40 @@
+'''
+Read queries for voice presence, shared by the voice and sync functions.
+Vendored into backend/voice/ and backend/sync/; keep the copies identical.
+'''
+from typing import Any, Dict, List
+
+from db import execute_prepared, prepare
+
+PRESENCE_TIMEOUT = '45 seconds'
+
+# Polled by every client in the voice panel
+prepare('voice_channels', f'''
+    SELECT ch.id, ch.name, COUNT(vc.id)
+    FROM voice_channels ch
+    LEFT JOIN voice_connections vc
+        ON vc.channel_id = ch.id
+        AND vc.disconnected_at IS NULL
+        AND vc.last_seen_at >= NOW() - INTERVAL '{PRESENCE_TIMEOUT}'
+    GROUP BY ch.id, ch.name
+    ORDER BY ch.id
+''')
+
+prepare('voice_peers', f'''
+    SELECT vc.peer_id, u.display_name, u.avatar
+    FROM voice_connections vc
+    JOIN users u ON vc.user_id = u.id
+    WHERE vc.channel_id = %s AND vc.disconnected_at IS NULL
+    AND vc.last_seen_at >= NOW() - INTERVAL '{PRESENCE_TIMEOUT}'
+    ORDER BY vc.id
+''')
+
+def fetch_channels(conn) -> List[Dict[str, Any]]:
+    with conn.cursor() as cur:
+        execute_prepared(cur, 'voice_channels')
+        return [{'id': row[0], 'name': row[1], 'users': row[2]} for row in cur.fetchall()]
+
+def fetch_peers(conn, channel_id) -> List[Dict[str, Any]]:
+    with conn.cursor() as cur:
+        execute_prepared(cur, 'voice_peers', (channel_id,))
+        return [{'peer_id': p[0], 'name': p[1], 'avatar': p[2]} for p in cur.fetchall()]
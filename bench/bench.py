@@ -0,0 +1,363 @@
+'''
+In-process load test for the backend functions.
+
+Imports each backend/<function>/index.py handler directly and builds the
+same event dicts the platform passes. It seeds a local Postgres with
+configurable volumes and replays the frontend's 3-second polling mix from
+simulated clients. For each endpoint it reports throughput,
+p50/p95/p99 latency and queries per request, the latter read
+from the Server-Timing header the instrumentation layer attaches.
+
+    python bench/bench.py --dsn postgresql://localhost/lrl_bench --messages 10000 --clients 200
+    python bench/bench.py --initdb --compare bench/results/previous.json
+
+With --gateway http://host:port the same mix is sent over HTTP to a running
+backend/gateway.py, which must point at the seeded database.
+
+With --initdb a throwaway cluster is created via initdb/pg_ctl and removed
+afterwards. Results are written as JSON to bench/results/ so runs can be
+compared with --compare. Cold starts are measured separately by
+bench/coldstart.py.
+'''
+import argparse
+import base64
+import gzip
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlencode, urlsplit
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+MIGRATIONS = os.path.join(ROOT, 'db_migrations')
+RESULTS = os.path.join(ROOT, 'bench', 'results')
+POLL_INTERVAL = 3.0
+
+sys.path.insert(0, BACKEND)
+from gateway import load_handlers  # noqa: E402
+
+_http = threading.local()
+
+
+def http_handlers(base_url: str) -> Dict[str, Callable]:
+    '''Handlers that send each event to a running gateway over keep-alive HTTP instead of in-process'''
+    target = urlsplit(base_url)
+
+    def call(function: str, event: Dict[str, Any]) -> Dict[str, Any]:
+        conn = getattr(_http, 'conn', None)
+        if conn is None:
+            conn = _http.conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+        path = f'{target.path.rstrip("/")}/{function}/'
+        if event['queryStringParameters']:
+            path += '?' + urlencode(event['queryStringParameters'])
+        try:
+            conn.request(event['httpMethod'], path, body=event['body'], headers=event['headers'])
+            reply = conn.getresponse()
+            payload = reply.read()
+        except (OSError, http.client.HTTPException):
+            _http.conn = None
+            conn.close()
+            raise
+        headers = dict(reply.getheaders())
+        encoded = headers.get('Content-Encoding') == 'gzip'
+        return {
+            'statusCode': reply.status,
+            'headers': headers,
+            'isBase64Encoded': encoded,
+            'body': base64.b64encode(payload).decode() if encoded else payload.decode(),
+        }
+
+    return {name: (lambda event, context, name=name: call(name, event)) for name in
+            ['auth', 'chat', 'members', 'schedule', 'voice', 'sync']}
+
+
+SERVER_TIMING_QUERIES = re.compile(r'db;dur=[0-9.]+;desc="(\d+) queries"')
+
+
+def counted_queries(response: Optional[Dict[str, Any]]) -> int:
+    '''Query count reported by the handler's instrumentation in Server-Timing'''
+    match = SERVER_TIMING_QUERIES.search(((response or {}).get('headers') or {}).get('Server-Timing', ''))
+    return int(match.group(1)) if match else 0
+
+
+def start_local_cluster() -> Dict[str, Any]:
+    for tool in ('initdb', 'pg_ctl'):
+        if not shutil.which(tool):
+            sys.exit(f'{tool} not found on PATH; pass --dsn instead of --initdb')
+    data_dir = tempfile.mkdtemp(prefix='lrl-bench-')
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    subprocess.run(['initdb', '-D', data_dir, '-U', 'postgres', '--auth=trust'], check=True, capture_output=True)
+    subprocess.run(['pg_ctl', '-D', data_dir, '-o', f'-p {port} -k {data_dir}', '-w', 'start'],
+                   check=True, capture_output=True)
+    return {'data_dir': data_dir, 'dsn': f'postgresql://postgres@127.0.0.1:{port}/postgres'}
+
+
+def stop_local_cluster(cluster: Dict[str, Any]) -> None:
+    subprocess.run(['pg_ctl', '-D', cluster['data_dir'], '-m', 'immediate', 'stop'], capture_output=True)
+    shutil.rmtree(cluster['data_dir'], ignore_errors=True)
+
+
+def apply_migrations(dsn: str) -> None:
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        # The early migrations are not re-runnable, so remember what was applied
+        cur.execute('CREATE TABLE IF NOT EXISTS bench_migrations (name TEXT PRIMARY KEY)')
+        cur.execute('SELECT name FROM bench_migrations')
+        applied = {row[0] for row in cur.fetchall()}
+        for name in sorted(os.listdir(MIGRATIONS)):
+            if name in applied or not name.endswith('.sql'):
+                continue
+            with open(os.path.join(MIGRATIONS, name), encoding='utf-8') as migration:
+                cur.execute(migration.read())
+            cur.execute('INSERT INTO bench_migrations (name) VALUES (%s)', (name,))
+    conn.close()
+
+
+def seed(dsn: str, users: int, messages: int, voice_users: int) -> None:
+    sys.path.insert(0, os.path.join(BACKEND, 'chat'))
+    from archive import attached_partitions, create_partition
+
+    conn = psycopg2.connect(dsn)
+    attached = set(attached_partitions(conn))
+    with conn.cursor() as cur:
+        # Seeded messages are one second apart back from now; give each month they reach its own partition
+        cur.execute('''
+            SELECT m::date
+            FROM generate_series(DATE_TRUNC('month', NOW() - %s * INTERVAL '1 second'), NOW(), INTERVAL '1 month') m
+        ''', (messages,))
+        for (month,) in cur.fetchall():
+            if month not in attached:
+                create_partition(cur, month)
+        cur.execute('''
+            INSERT INTO users (username, password_hash, display_name, role, last_active_at)
+            SELECT 'bench_' || g, 'x', 'Боец ' || g,
+                   CASE WHEN g % 10 = 0 THEN 'Офицер' ELSE 'Солдат' END,
+                   NOW() - (g % 60) * INTERVAL '1 minute'
+            FROM generate_series(1, %s) g
+            ON CONFLICT (username) DO NOTHING
+        ''', (users,))
+        cur.execute('''
+            INSERT INTO messages (author, avatar, content, role, created_at)
+            SELECT 'Боец ' || (g % %s + 1), '/placeholder.svg',
+                   repeat('Сообщение для нагрузочного теста ', 1 + g % 4),
+                   'Солдат', NOW() - (%s - g) * INTERVAL '1 second'
+            FROM generate_series(1, %s) g
+        ''', (max(users, 1), messages, messages))
+        cur.execute('''
+            INSERT INTO voice_connections (channel_id, user_id, peer_id, connected_at, last_seen_at)
+            SELECT (SELECT id FROM voice_channels ORDER BY id LIMIT 1 OFFSET (u.id % 3)),
+                   u.id, 'bench-peer-' || u.id, NOW(), NOW()
+            FROM users u WHERE u.username LIKE 'bench_%%' ORDER BY u.id LIMIT %s
+        ''', (voice_users,))
+    conn.commit()
+    conn.close()
+
+
+def event(method: str = 'GET', params: Optional[Dict[str, str]] = None, body: Any = None) -> Dict[str, Any]:
+    return {
+        'httpMethod': method,
+        'headers': {'Accept-Encoding': 'gzip'},
+        'queryStringParameters': params or {},
+        'body': json.dumps(body) if body is not None else '{}',
+        'isBase64Encoded': False,
+    }
+
+
+class Client:
+    '''One browser tab replaying the frontend's poll for the chosen mix'''
+
+    def __init__(self, handlers: Dict[str, Callable], mix: str, channel_id: Optional[int]):
+        self.handlers = handlers
+        self.mix = mix
+        self.channel_id = channel_id
+        self.chat_cursor: Dict[str, Any] = {}
+        self.versions: Dict[str, str] = {}
+
+    def poll(self) -> List[tuple]:
+        if self.mix == 'sync':
+            params = {f'{section}_version': version for section, version in self.versions.items()}
+            params.update({f'chat_{key}': str(value) for key, value in self.chat_cursor.items() if value is not None})
+            if self.channel_id:
+                params['channel_id'] = str(self.channel_id)
+            return [('sync', 'sync', event(params=params))]
+
+        calls = []
+        if self.mix == 'delta' and self.chat_cursor:
+            cursor = {key: str(value) for key, value in self.chat_cursor.items() if key != 'before'}
+            calls.append(('chat_delta', 'chat', event(params=cursor)))
+        else:
+            calls.append(('chat_full', 'chat', event()))
+        calls.append(('voice_list', 'voice', event(params={'action': 'list'})))
+        calls.append(('members', 'members', event()))
+        if self.channel_id:
+            calls.append(('voice_peers', 'voice', event(params={'action': 'peers', 'channel_id': str(self.channel_id)})))
+        return calls
+
+    def observe(self, endpoint: str, response: Dict[str, Any]) -> None:
+        if response['statusCode'] != 200:
+            return
+        raw = response['body']
+        if response.get('isBase64Encoded'):
+            raw = gzip.decompress(base64.b64decode(raw))
+        body = json.loads(raw)
+        if endpoint in ('chat_full', 'chat_delta') and 'cursor' in body:
+            self.chat_cursor = {k: v for k, v in body['cursor'].items() if k != 'before'}
+        if endpoint == 'sync':
+            if 'chat' in body:
+                self.chat_cursor = {k: v for k, v in body['chat']['cursor'].items() if k != 'before'}
+            for section in ('voice', 'members', 'peers'):
+                if section in body:
+                    self.versions[section] = body[section]['version']
+
+
+def run(handlers: Dict[str, Callable], clients: int, duration: float, workers: int, mix: str) -> Dict[str, Any]:
+    samples: Dict[str, List[float]] = defaultdict(list)
+    queries: Dict[str, List[int]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    population = [Client(handlers, mix, random.choice([None, 1, 2, 3])) for _ in range(clients)]
+
+    def execute(client: Client, endpoint: str, function: str, request: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        try:
+            response = handlers[function](request, None)
+            failed = response['statusCode'] >= 500
+        except Exception:
+            response, failed = None, True
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            samples[endpoint].append(elapsed)
+            queries[endpoint].append(counted_queries(response))
+            if failed:
+                errors[endpoint] += 1
+        if response is not None:
+            client.observe(endpoint, response)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Each client polls every POLL_INTERVAL seconds, staggered evenly across the interval
+        tick = 0
+        while time.monotonic() - started < duration:
+            for index, client in enumerate(population):
+                due = started + tick * POLL_INTERVAL + index * POLL_INTERVAL / clients
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                for endpoint, function, request in client.poll():
+                    pool.submit(execute, client, endpoint, function, request)
+            tick += 1
+    elapsed = time.monotonic() - started
+
+    report = {}
+    for endpoint, latencies in sorted(samples.items()):
+        latencies.sort()
+        report[endpoint] = {
+            'requests': len(latencies),
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'queries_per_request': round(sum(queries[endpoint]) / len(queries[endpoint]), 2),
+            'errors': errors[endpoint],
+        }
+    return report
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    header = f'{"endpoint":<14}{"req":>8}{"rps":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"q/req":>8}{"err":>6}'
+    print(header)
+    print('-' * len(header))
+    for endpoint, stats in report.items():
+        line = (f'{endpoint:<14}{stats["requests"]:>8}{stats["throughput_rps"]:>9}{stats["p50_ms"]:>9}'
+                f'{stats["p95_ms"]:>9}{stats["p99_ms"]:>9}{stats["queries_per_request"]:>8}{stats["errors"]:>6}')
+        previous = (baseline or {}).get(endpoint)
+        if previous and previous['p99_ms']:
+            change = (stats['p99_ms'] - previous['p99_ms']) / previous['p99_ms'] * 100
+            line += f'   p99 {change:+.1f}% vs baseline'
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='In-process load test for the backend functions')
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--initdb', action='store_true', help='run against a throwaway local cluster')
+    parser.add_argument('--replica-dsn', default=os.environ.get('DATABASE_URL_READ'),
+                        help='streaming replica of --dsn; read-only paths are routed to it')
+    parser.add_argument('--gateway', help='drive a running backend/gateway.py at this URL instead of in-process')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse an already migrated and seeded database')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--voice-users', type=int, default=30)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--mix', choices=['legacy', 'delta', 'sync'], default='legacy')
+    parser.add_argument('--output', help='result file (default: bench/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='previous result file to diff p99 against')
+    args = parser.parse_args()
+
+    cluster = start_local_cluster() if args.initdb else None
+    dsn = cluster['dsn'] if cluster else args.dsn
+    if not dsn:
+        sys.exit('Pass --dsn, set DATABASE_URL or use --initdb')
+    os.environ['DATABASE_URL'] = dsn
+    if args.replica_dsn:
+        os.environ['DATABASE_URL_READ'] = args.replica_dsn
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.workers))
+    os.environ['INSTRUMENT_SAMPLE_RATE'] = '1'
+
+    try:
+        if not args.skip_seed:
+            apply_migrations(dsn)
+            seed(dsn, args.users, args.messages, args.voice_users)
+        handlers = http_handlers(args.gateway) if args.gateway else load_handlers()
+        report = run(handlers, args.clients, args.duration, args.workers, args.mix)
+    finally:
+        if cluster:
+            stop_local_cluster(cluster)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as previous:
+            baseline = json.load(previous)['endpoints']
+    print_report(report, baseline)
+
+    result = {
+        'recorded_at': datetime.now(timezone.utc).isoformat(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('dsn', 'replica_dsn', 'output', 'compare')},
+        'endpoints': report,
+    }
+    output = args.output or os.path.join(RESULTS, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as result_file:
+        json.dump(result, result_file, indent=2, ensure_ascii=False)
+    print(f'\nSaved {output}')
+
+
+if __name__ == '__main__':
+    main()
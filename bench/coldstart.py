@@ -0,0 +1,177 @@
+'''
+Cold-start benchmark for the backend functions.
+
+Each run starts a fresh interpreter (python -X importtime) in the function's
+directory, imports its index.py the way the platform does, including the
+module-level db warmup, and sends one representative first request. It
+reports import time with the slowest top-level modules, the warmup connect,
+and the first request with its connect phase read from Server-Timing. It
+reports medians over --runs.
+
+    python bench/coldstart.py --dsn postgresql://localhost/lrl_bench
+    python bench/coldstart.py --initdb --no-warmup --compare bench/results/coldstart-previous.json
+
+Results are written to bench/results/coldstart-<timestamp>.json.
+'''
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from bench import BACKEND, RESULTS, apply_migrations, seed, start_local_cluster, stop_local_cluster
+
+FUNCTIONS = ['auth', 'chat', 'members', 'schedule', 'voice', 'sync']
+FIRST_REQUESTS = {
+    'auth': {'httpMethod': 'POST', 'body': json.dumps({'action': 'login', 'username': 'coldstart', 'password': 'x'})},
+    'chat': {'httpMethod': 'GET', 'queryStringParameters': {'limit': '50'}},
+    'members': {'httpMethod': 'GET', 'queryStringParameters': {}},
+    'schedule': {'httpMethod': 'GET', 'queryStringParameters': {}},
+    'voice': {'httpMethod': 'GET', 'queryStringParameters': {'action': 'list'}},
+    'sync': {'httpMethod': 'GET', 'queryStringParameters': {}},
+}
+
+# Runs inside the fresh interpreter; the result is the last stdout line
+PROBE = '''
+import importlib.util, json, sys, time
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('index', 'index.py')
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+event = dict({'headers': {}, 'queryStringParameters': {}, 'body': '{}', 'isBase64Encoded': False}, **json.loads(sys.argv[1]))
+response = module.handler(event, None)
+finished = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (finished - imported) * 1000,
+    'status': response.get('statusCode'),
+    'server_timing': (response.get('headers') or {}).get('Server-Timing', ''),
+}))
+'''
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+CONNECT_PHASE = re.compile(r'(?:^|, )connect;dur=([0-9.]+)')
+
+
+def top_level_imports(stderr: str, exclude: Set[str] = frozenset()) -> Dict[str, float]:
+    '''Cumulative milliseconds of each module imported directly by index.py (or by the probe)'''
+    modules = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) == 1 and match.group(4) not in exclude:
+            modules[match.group(4)] = int(match.group(2)) / 1000
+    return modules
+
+
+def interpreter_imports() -> Set[str]:
+    '''Modules the bare interpreter loads at startup, left out of the per-function listing'''
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'pass'], capture_output=True, text=True)
+    return set(top_level_imports(completed.stderr))
+
+
+def probe(function: str, startup: Set[str]) -> Dict[str, Any]:
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE, json.dumps(FIRST_REQUESTS[function])],
+        cwd=os.path.join(BACKEND, function), capture_output=True, text=True, timeout=120)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode or not lines:
+        raise RuntimeError(f'{function} probe failed:\n{completed.stderr[-2000:]}')
+    result = json.loads(lines[-1])
+    warmup = next((json.loads(line)['db_warmup'] for line in lines if '"db_warmup": {' in line), {})
+    connect = CONNECT_PHASE.search(result.pop('server_timing'))
+    result['warmup_connect_ms'] = warmup.get('primary_connect_ms', 0.0)
+    result['first_connect_ms'] = float(connect.group(1)) if connect else 0.0
+    result['modules'] = top_level_imports(completed.stderr, startup)
+    return result
+
+
+def measure(function: str, runs: int, top: int, startup: Set[str]) -> Dict[str, Any]:
+    samples = [probe(function, startup) for _ in range(runs)]
+    modules: Dict[str, List[float]] = defaultdict(list)
+    for sample in samples:
+        for name, elapsed in sample['modules'].items():
+            modules[name].append(elapsed)
+    slowest = sorted(((name, statistics.median(values)) for name, values in modules.items()),
+                     key=lambda item: item[1], reverse=True)[:top]
+    stats = {key: round(statistics.median(sample[key] for sample in samples), 2)
+             for key in ('import_ms', 'warmup_connect_ms', 'first_request_ms', 'first_connect_ms')}
+    stats['cold_start_ms'] = round(stats['import_ms'] + stats['first_request_ms'], 2)
+    stats['status'] = samples[-1]['status']
+    stats['slowest_imports'] = {name: round(elapsed, 2) for name, elapsed in slowest}
+    return stats
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    header = f'{"function":<10}{"import":>9}{"warmup":>9}{"first":>9}{"connect":>9}{"cold":>9}{"status":>8}'
+    print(header)
+    print('-' * len(header))
+    for function, stats in report.items():
+        line = (f'{function:<10}{stats["import_ms"]:>9}{stats["warmup_connect_ms"]:>9}{stats["first_request_ms"]:>9}'
+                f'{stats["first_connect_ms"]:>9}{stats["cold_start_ms"]:>9}{stats["status"]:>8}')
+        previous = (baseline or {}).get(function)
+        if previous and previous['cold_start_ms']:
+            change = (stats['cold_start_ms'] - previous['cold_start_ms']) / previous['cold_start_ms'] * 100
+            line += f'   cold {change:+.1f}% vs baseline'
+        print(line)
+    print('\nSlowest top-level imports (ms):')
+    for function, stats in report.items():
+        print(f'  {function:<10}' + ', '.join(f'{name} {elapsed}' for name, elapsed in stats['slowest_imports'].items()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Cold-start benchmark for the backend functions')
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--initdb', action='store_true', help='run against a throwaway local cluster')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse an already migrated and seeded database')
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS, default=FUNCTIONS)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per function')
+    parser.add_argument('--top', type=int, default=5, help='slowest imports to list per function')
+    parser.add_argument('--no-warmup', action='store_true', help='set DB_WARMUP_CONNECT=0 to measure a lazy first connect')
+    parser.add_argument('--output', help='result file (default: bench/results/coldstart-<timestamp>.json)')
+    parser.add_argument('--compare', help='previous coldstart result file to diff against')
+    args = parser.parse_args()
+
+    cluster = start_local_cluster() if args.initdb else None
+    dsn = cluster['dsn'] if cluster else args.dsn
+    if not dsn:
+        sys.exit('Pass --dsn, set DATABASE_URL or use --initdb')
+    os.environ['DATABASE_URL'] = dsn
+    os.environ['INSTRUMENT_SAMPLE_RATE'] = '1'
+    os.environ['DB_WARMUP_CONNECT'] = '0' if args.no_warmup else '1'
+
+    try:
+        if not args.skip_seed:
+            apply_migrations(dsn)
+            seed(dsn, 50, 1000, 10)
+        startup = interpreter_imports()
+        report = {function: measure(function, args.runs, args.top, startup) for function in args.functions}
+    finally:
+        if cluster:
+            stop_local_cluster(cluster)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as previous:
+            baseline = json.load(previous)['functions']
+    print_report(report, baseline)
+
+    result = {
+        'recorded_at': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'config': {key: value for key, value in vars(args).items() if key not in ('dsn', 'output', 'compare')},
+        'functions': report,
+    }
+    output = args.output or os.path.join(RESULTS, datetime.now().strftime('coldstart-%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as result_file:
+        json.dump(result, result_file, indent=2, ensure_ascii=False)
+    print(f'\nSaved {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+-- Deletion log so delta polling clients can drop removed messages
+CREATE TABLE IF NOT EXISTS message_deletions (
+    id BIGSERIAL PRIMARY KEY,
+    message_id BIGINT NOT NULL,
+    deleted_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_deletions_message ON message_deletions(message_id);
@@ -0,0 +1,4 @@
+-- Partial index for channel occupancy and peer lookups on active connections
+CREATE INDEX IF NOT EXISTS idx_voice_connections_active
+    ON voice_connections(channel_id, connected_at)
+    WHERE disconnected_at IS NULL;
@@ -0,0 +1,14 @@
+-- Heartbeat-driven voice presence
+ALTER TABLE voice_connections ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP DEFAULT NOW();
+
+UPDATE voice_connections SET last_seen_at = connected_at;
+
+DROP INDEX IF EXISTS idx_voice_connections_active;
+
+CREATE INDEX IF NOT EXISTS idx_voice_connections_active
+    ON voice_connections(channel_id, last_seen_at)
+    WHERE disconnected_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_voice_connections_active_peer
+    ON voice_connections(peer_id)
+    WHERE disconnected_at IS NULL;
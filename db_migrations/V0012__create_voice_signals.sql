@@ -0,0 +1,11 @@
+-- Per-peer WebRTC signaling mailbox
+CREATE TABLE IF NOT EXISTS voice_signals (
+    id BIGSERIAL PRIMARY KEY,
+    to_peer VARCHAR(255) NOT NULL,
+    from_peer VARCHAR(255) NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_voice_signals_to_peer ON voice_signals(to_peer, id);
+CREATE INDEX IF NOT EXISTS idx_voice_signals_created_at ON voice_signals(created_at);
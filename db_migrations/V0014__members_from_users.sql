@@ -0,0 +1,8 @@
+-- Serve the roster from users with presence from chat activity and voice heartbeats
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_active_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_users_role_id ON users(role, id);
+CREATE INDEX IF NOT EXISTS idx_users_last_active_at ON users(last_active_at);
+CREATE INDEX IF NOT EXISTS idx_voice_connections_active_user
+    ON voice_connections(user_id, last_seen_at)
+    WHERE disconnected_at IS NULL;
@@ -0,0 +1,9 @@
+-- Full-text search over chat messages: Russian stemming plus exact 'simple' tokens
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', COALESCE(content, '')), 'A') ||
+        setweight(to_tsvector('simple', COALESCE(content, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_messages_author_id ON messages(author, id);
@@ -0,0 +1,54 @@
+-- Convert messages to monthly range partitions on created_at; old months are archived by chat maintenance
+ALTER TABLE messages RENAME TO messages_unpartitioned;
+ALTER SEQUENCE messages_id_seq OWNED BY NONE;
+ALTER INDEX IF EXISTS idx_messages_search RENAME TO idx_messages_unpartitioned_search;
+ALTER INDEX IF EXISTS idx_messages_author_id RENAME TO idx_messages_unpartitioned_author_id;
+ALTER INDEX IF EXISTS idx_messages_created_at RENAME TO idx_messages_unpartitioned_created_at;
+
+CREATE TABLE messages (
+    id BIGINT NOT NULL DEFAULT nextval('messages_id_seq'),
+    author VARCHAR(255) NOT NULL,
+    avatar VARCHAR(500),
+    content TEXT NOT NULL,
+    role VARCHAR(100),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', COALESCE(content, '')), 'A') ||
+        setweight(to_tsvector('simple', COALESCE(content, '')), 'B')
+    ) STORED,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+CREATE INDEX IF NOT EXISTS idx_messages_id ON messages(id);
+CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_messages_author_id ON messages(author, id);
+
+-- One partition per month from the oldest message through three months ahead
+DO $$
+DECLARE
+    month DATE := DATE_TRUNC('month', COALESCE((SELECT MIN(created_at) FROM messages_unpartitioned), NOW()));
+BEGIN
+    WHILE month <= DATE_TRUNC('month', NOW()) + INTERVAL '3 months' LOOP
+        EXECUTE FORMAT(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+            'messages_' || TO_CHAR(month, 'YYYY_MM'), month, month + INTERVAL '1 month'
+        );
+        month := month + INTERVAL '1 month';
+    END LOOP;
+END $$;
+
+INSERT INTO messages (id, author, avatar, content, role, created_at)
+SELECT id, author, avatar, content, role, COALESCE(created_at, NOW())
+FROM messages_unpartitioned;
+
+DROP TABLE messages_unpartitioned;
+
+CREATE TABLE IF NOT EXISTS message_archives (
+    month DATE PRIMARY KEY,
+    path VARCHAR(1000) NOT NULL,
+    row_count INTEGER NOT NULL,
+    archived_at TIMESTAMP DEFAULT NOW()
+);
@@ -0,0 +1,4 @@
+-- Soft-delete tombstones for moderation; chat maintenance purges them after the retention window
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_messages_deleted_at ON messages(deleted_at) WHERE deleted_at IS NOT NULL;
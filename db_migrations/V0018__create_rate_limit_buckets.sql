@@ -0,0 +1,9 @@
+-- Shared token buckets for per-user rate limiting; UNLOGGED because losing them on crash only resets limits
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+    bucket VARCHAR(255) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    admitted BOOLEAN NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_updated_at ON rate_limit_buckets(updated_at);
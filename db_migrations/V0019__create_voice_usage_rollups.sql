@@ -0,0 +1,22 @@
+-- Daily voice usage rollups; voice maintenance compacts closed sessions into them
+CREATE TABLE IF NOT EXISTS voice_usage_daily (
+    day DATE NOT NULL,
+    channel_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, channel_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS voice_channel_peaks (
+    day DATE NOT NULL,
+    channel_id INTEGER NOT NULL,
+    peak_concurrency INTEGER NOT NULL,
+    PRIMARY KEY (day, channel_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_voice_usage_daily_user ON voice_usage_daily(user_id, day);
+
+CREATE INDEX IF NOT EXISTS idx_voice_connections_closed
+    ON voice_connections(id)
+    WHERE disconnected_at IS NOT NULL;
@@ -0,0 +1,2 @@
+-- Catch-all partition so chat POSTs keep working if maintenance has not created the month yet; maintenance moves its rows into the month partition
+CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT;
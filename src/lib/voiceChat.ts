@@ -4,6 +4,7 @@ export interface VoiceChatOptions {
   channelId: number;
   userId: number;
   apiUrl: string;
+  token: string;
   userRole?: string;
   onPeerJoin?: (peerId: string, name: string) => void;
   onPeerLeave?: (peerId: string) => void;
@@ -15,9 +16,11 @@ export class VoiceChat {
   private channelId: number;
   private userId: number;
   private apiUrl: string;
+  private token: string;
   private myPeerId: string;
   private userRole: string;
   private peers: Map<string, SimplePeer.Instance> = new Map();
+  private announcedPeers: Set<string> = new Set();
   private peerGains: Map<string, GainNode> = new Map();
   private localStream: MediaStream | null = null;
   private onPeerJoin?: (peerId: string, name: string) => void;
@@ -25,7 +28,9 @@ export class VoiceChat {
   private onError?: (error: Error) => void;
   private onSpeaking?: (peerId: string, isSpeaking: boolean) => void;
   private pollInterval: number | null = null;
+  private heartbeatInterval: number | null = null;
   private connected: boolean = false;
+  private rejoinNotBefore: number = 0;
   private audioContext: AudioContext | null = null;
   private analyser: AnalyserNode | null = null;
   private speakingCheckInterval: number | null = null;
@@ -34,6 +39,7 @@ export class VoiceChat {
     this.channelId = options.channelId;
     this.userId = options.userId;
     this.apiUrl = options.apiUrl;
+    this.token = options.token;
     this.userRole = options.userRole || 'Солдат';
     this.myPeerId = `peer-${Date.now()}-${Math.random().toString(36).substr(2, 9)}`;
     this.onPeerJoin = options.onPeerJoin;
@@ -53,22 +59,11 @@ export class VoiceChat {
         video: false 
       });
 
-      const response = await fetch(this.apiUrl, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          action: 'join',
-          channel_id: this.channelId,
-          user_id: this.userId,
-          peer_id: this.myPeerId
-        })
-      });
-
-      if (!response.ok) {
-        throw new Error('Failed to join voice channel');
-      }
+      const heartbeatSeconds = await this.join();
 
       this.connected = true;
+      this.startHeartbeat(heartbeatSeconds);
+      this.receiveSignals();
       this.startPolling();
       this.startSpeakingDetection();
     } catch (error) {
@@ -77,6 +72,65 @@ export class VoiceChat {
     }
   }
 
+  // The server only accepts mailbox and presence calls for peers joined under this token
+  private jsonHeaders(): Record<string, string> {
+    return {
+      'Content-Type': 'application/json',
+      'Authorization': `Bearer ${this.token}`
+    };
+  }
+
+  private async join(): Promise<number> {
+    const response = await fetch(this.apiUrl, {
+      method: 'POST',
+      headers: this.jsonHeaders(),
+      body: JSON.stringify({
+        action: 'join',
+        channel_id: this.channelId,
+        user_id: this.userId,
+        peer_id: this.myPeerId
+      })
+    });
+
+    if (response.status === 429) {
+      const retryAfter = Number(response.headers.get('Retry-After')) || 5;
+      this.rejoinNotBefore = Date.now() + retryAfter * 1000;
+      throw new Error('Too many join attempts, retrying later');
+    }
+
+    if (!response.ok) {
+      throw new Error('Failed to join voice channel');
+    }
+
+    const data = await response.json();
+    return data.heartbeat_interval || 15;
+  }
+
+  private startHeartbeat(intervalSeconds: number): void {
+    const beat = async () => {
+      if (!this.connected) return;
+
+      try {
+        const response = await fetch(this.apiUrl, {
+          method: 'POST',
+          headers: this.jsonHeaders(),
+          body: JSON.stringify({
+            action: 'heartbeat',
+            peer_id: this.myPeerId
+          })
+        });
+
+        if (response.status === 404 && Date.now() >= this.rejoinNotBefore) {
+          await this.join();
+        }
+      } catch (error) {
+        console.error('Heartbeat error:', error);
+      }
+    };
+
+    this.heartbeatInterval = window.setInterval(beat, intervalSeconds * 1000);
+  }
+
   private startSpeakingDetection(): void {
     if (!this.localStream) return;
 
@@ -119,8 +173,14 @@ export class VoiceChat {
         }
         
         for (const peer of data.peers) {
-          if (peer.peer_id !== this.myPeerId && !this.peers.has(peer.peer_id)) {
-            this.createPeer(peer.peer_id, true);
+          if (peer.peer_id === this.myPeerId) continue;
+
+          if (!this.peers.has(peer.peer_id)) {
+            // Only one side of each pair sends the offer; the other waits for it in receiveSignals
+            this.createPeer(peer.peer_id, this.myPeerId > peer.peer_id);
+          }
+          if (!this.announcedPeers.has(peer.peer_id)) {
+            this.announcedPeers.add(peer.peer_id);
             this.onPeerJoin?.(peer.peer_id, peer.name);
           }
         }
@@ -133,6 +193,30 @@ export class VoiceChat {
     this.pollInterval = window.setInterval(checkPeers, 3000);
   }
 
+  private async receiveSignals(): Promise<void> {
+    while (this.connected) {
+      try {
+        const response = await fetch(`${this.apiUrl}?action=drain&peer_id=${this.myPeerId}&wait=20`, {
+          headers: { 'Authorization': `Bearer ${this.token}` }
+        });
+        if (!response.ok) {
+          throw new Error(`Signal drain failed with ${response.status}`);
+        }
+        const data = await response.json();
+
+        for (const { from_peer, signal } of data.signals || []) {
+          if (!this.peers.has(from_peer)) {
+            this.createPeer(from_peer, false);
+          }
+          this.peers.get(from_peer)?.signal(signal);
+        }
+      } catch (error) {
+        console.error('Signal drain error:', error);
+        await new Promise(resolve => setTimeout(resolve, 3000));
+      }
+    }
+  }
+
   private createPeer(peerId: string, initiator: boolean): void {
     if (!this.localStream) return;
 
@@ -151,7 +235,7 @@ export class VoiceChat {
     peer.on('signal', (signal) => {
       fetch(this.apiUrl, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: this.jsonHeaders(),
         body: JSON.stringify({
           action: 'signal',
           from_peer: this.myPeerId,
@@ -207,6 +291,7 @@ export class VoiceChat {
       this.peerGains.delete(peerId);
     }
     
+    this.announcedPeers.delete(peerId);
     this.onPeerLeave?.(peerId);
   }
 
@@ -218,6 +303,11 @@ export class VoiceChat {
       this.pollInterval = null;
     }
 
+    if (this.heartbeatInterval) {
+      clearInterval(this.heartbeatInterval);
+      this.heartbeatInterval = null;
+    }
+
     if (this.speakingCheckInterval) {
       clearInterval(this.speakingCheckInterval);
       this.speakingCheckInterval = null;
@@ -241,7 +331,7 @@ export class VoiceChat {
     try {
       await fetch(this.apiUrl, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: this.jsonHeaders(),
         body: JSON.stringify({
           action: 'leave',
           peer_id: this.myPeerId
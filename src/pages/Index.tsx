@@ -16,6 +16,22 @@ const VOICE_API = "https://functions.poehali.dev/e6fbfc6f-2e2c-411f-9639-bb2f73d
 const MEMBERS_API = "https://functions.poehali.dev/7693979e-2693-4853-8810-416811336dc9";
 const SCHEDULE_API = "https://functions.poehali.dev/1559ce35-681a-40a8-b477-47a554a8df9f";
 
+const authHeaders = () => ({
+  'Content-Type': 'application/json',
+  'Authorization': `Bearer ${localStorage.getItem('lrl_token') || ''}`
+});
+
+// After our own write, reads go to the primary until this time so they include it
+let primaryUntil = 0;
+
+const rememberWrite = (response: Response) => {
+  primaryUntil = Number(response.headers.get('X-Primary-Until')) || primaryUntil;
+  return response;
+};
+
+const readHeaders = (): Record<string, string> =>
+  Date.now() < primaryUntil ? { 'X-Primary-Until': String(primaryUntil) } : {};
+
 interface User {
   id: number;
   username: string;
@@ -70,7 +86,7 @@ const Index = () => {
 
   useEffect(() => {
     const savedUser = localStorage.getItem('lrl_user');
-    if (savedUser) {
+    if (savedUser && localStorage.getItem('lrl_token')) {
       setUser(JSON.parse(savedUser));
       setShowAuth(false);
     }
@@ -95,13 +111,13 @@ const Index = () => {
   }, [user, connectedChannel]);
 
   const loadMessages = async () => {
-    const response = await fetch(CHAT_API);
+    const response = await fetch(CHAT_API, { headers: readHeaders() });
     const data = await response.json();
     setMessages(data.messages);
   };
 
   const loadVoiceChannels = async () => {
-    const response = await fetch(`${VOICE_API}?action=list`);
+    const response = await fetch(`${VOICE_API}?action=list`, { headers: readHeaders() });
     const data = await response.json();
     setVoiceChannels(data.channels.map((ch: any) => ({
       ...ch,
@@ -110,7 +126,7 @@ const Index = () => {
   };
 
   const loadMembers = async () => {
-    const response = await fetch(MEMBERS_API);
+    const response = await fetch(MEMBERS_API, { headers: readHeaders() });
     const data = await response.json();
     setMembers(data.members);
   };
@@ -122,7 +138,7 @@ const Index = () => {
   };
 
   const loadVoiceChannelPeers = async (channelId: number) => {
-    const response = await fetch(`${VOICE_API}?action=peers&channel_id=${channelId}`);
+    const response = await fetch(`${VOICE_API}?action=peers&channel_id=${channelId}`, { headers: readHeaders() });
     const data = await response.json();
     setVoiceChannelPeers(data.peers || []);
   };
@@ -178,6 +194,11 @@ const Index = () => {
   };
 
   const handleLogout = () => {
+    fetch(AUTH_API, {
+      method: 'POST',
+      headers: authHeaders(),
+      body: JSON.stringify({ action: 'logout' })
+    }).catch(() => {});
     setUser(null);
     localStorage.removeItem('lrl_user');
     localStorage.removeItem('lrl_token');
@@ -202,6 +223,7 @@ const Index = () => {
           channelId,
           userId: user!.id,
           apiUrl: VOICE_API,
+          token: localStorage.getItem('lrl_token') || '',
           userRole: user!.role,
           onPeerJoin: (peerId, name) => {
             playJoinSound();
@@ -284,29 +306,26 @@ const Index = () => {
   const handleDeleteMessage = async (messageId: number) => {
     if (user?.role !== 'Офицер') return;
     
-    await fetch(`${CHAT_API}?message_id=${messageId}`, {
+    rememberWrite(await fetch(`${CHAT_API}?message_id=${messageId}`, {
       method: 'DELETE',
-      headers: { 
-        'Content-Type': 'application/json',
-        'X-User-Role': user.role
-      }
-    });
+      headers: authHeaders()
+    }));
     toast.success('Сообщение удалено');
     loadMessages();
   };
 
   const handleSendMessage = async () => {
     if (messageInput.trim() && user) {
-      await fetch(CHAT_API, {
+      rememberWrite(await fetch(CHAT_API, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(),
         body: JSON.stringify({
           author: user.display_name,
           content: messageInput,
           role: user.role,
           avatar: user.avatar
         })
-      });
+      }));
       setMessageInput("");
       loadMessages();
     }